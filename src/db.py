@@ -1,18 +1,207 @@
 import sqlite3
 import os
 import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
 # Ensure data directory exists
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 DB_PATH = os.path.join(DATA_DIR, 'games.db')
 
+# Tables whose changes invalidate cached recommender state.
+# Value restricts UPDATE triggers to the columns that matter (None = any column).
+VERSIONED_TABLES = {
+    'user_library': 'game_id, playtime_minutes, manual_play_status',
+    'ratings': None,
+    'ignored_recommendations': None,
+}
+
+# Tag lists normalized into game_tags (keys match the IGDB dicts and the old JSON columns)
+TAG_KINDS = ('genres', 'themes', 'keywords', 'developers', 'game_modes')
+
+# --- Connections ---
+# get_db_connection() hands out one connection per thread, taken from a small pool of open ones.
+# Nested calls on the same thread share it; the outermost close() rolls back anything left
+# uncommitted (as closing a real connection would) and returns it to the pool.
+# WAL lets readers carry on while a sync is writing.
+
+BUSY_TIMEOUT = 10 # seconds a statement waits on a locked database before failing
+CACHE_SIZE_KB = 32 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+MAX_IDLE_CONNECTIONS = 8
+# Connections run PRAGMA optimize when returned to the pool at most this often (seconds)
+OPTIMIZE_INTERVAL = 3600
+
+class PooledConnection(sqlite3.Connection):
+    def close(self):
+        _release(self)
+
+_local = threading.local()
+_idle = []
+_pool_lock = threading.Lock()
+_last_optimize = time.time()
+
+def _open_connection():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # check_same_thread is off because pooled connections move between threads (one at a time)
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False, factory=PooledConnection)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return conn
+
 def get_db_connection():
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
-    conn = sqlite3.connect(DB_PATH)
+    """Returns this thread's connection. Callers close() it when done, as before."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        with _pool_lock:
+            conn = _idle.pop() if _idle else None
+        conn = conn or _open_connection()
+        _local.conn, _local.refs, _local.pinned = conn, 0, False
+    _local.refs += 1
     conn.row_factory = sqlite3.Row
     return conn
 
+def thread_connection():
+    """This thread's connection for long-lived holders (RecommenderEngine) that never close it.
+    It stays with the thread until release_thread_connection()."""
+    conn = get_db_connection()
+    if _local.pinned:
+        _local.refs -= 1
+    _local.pinned = True
+    return conn
+
+def release_thread_connection():
+    """Unpins this thread's connection and returns it to the pool if nothing else holds it (end of a web request)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pinned:
+        _local.pinned = False
+        _release(conn)
+
+def _release(conn):
+    if getattr(_local, 'conn', None) is not conn:
+        return # closed twice, or from a thread that doesn't hold it
+    _local.refs -= 1
+    if _local.refs > 0:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    _maybe_optimize(conn)
+    with _pool_lock:
+        if len(_idle) < MAX_IDLE_CONNECTIONS:
+            _idle.append(conn)
+            return
+    sqlite3.Connection.close(conn)
+
+def close_idle_connections():
+    """Closes the pooled connections no thread holds, e.g. once DB_PATH points elsewhere."""
+    with _pool_lock:
+        idle = _idle[:]
+        _idle.clear()
+    for conn in idle:
+        sqlite3.Connection.close(conn)
+
+def _maybe_optimize(conn):
+    global _last_optimize
+    with _pool_lock:
+        if time.time() - _last_optimize < OPTIMIZE_INTERVAL:
+            return
+        _last_optimize = time.time()
+    try:
+        conn.execute("PRAGMA optimize")
+    except sqlite3.OperationalError as e:
+        print(f"PRAGMA optimize failed: {e}")
+
+# --- Writes ---
+# Every mutation runs on one writer thread with its own connection, so concurrent writers
+# (sync, enrichment, web handlers) queue up instead of failing with "database is locked".
+# Writes that pile up while one group is committing go into the next group together, one
+# transaction per group. Each write runs in its own savepoint, so one that fails only undoes
+# itself. Readers keep using get_db_connection() and are never blocked (WAL).
+
+# Most writes folded into one transaction
+WRITE_GROUP_SIZE = 64
+
+_writes = queue.Queue()
+_writer_thread = None
+_writer_conn = None
+_writer_lock = threading.Lock()
+
+def submit_write(fn, *args, **kwargs):
+    """
+    Queues fn(conn, *args, **kwargs) for the writer thread and returns a Future of its result.
+    fn must not commit or roll back; the writer does that for the whole group.
+    """
+    future = Future()
+    if threading.current_thread() is _writer_thread:
+        # A write issued from inside another write joins its transaction
+        try:
+            future.set_result(fn(_writer_conn, *args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    _start_writer()
+    _writes.put((fn, args, kwargs, future))
+    return future
+
+def write(fn, *args, **kwargs):
+    """Runs fn(conn, *args, **kwargs) on the writer thread and waits for it to be committed."""
+    return submit_write(fn, *args, **kwargs).result()
+
+def _start_writer():
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_run_writer, name="db-writer", daemon=True)
+            _writer_thread.start()
+
+def _run_writer():
+    global _writer_conn
+    conn = _writer_conn = _open_connection()
+    conn.row_factory = sqlite3.Row
+    # Transactions are managed here, not by the sqlite3 module
+    conn.isolation_level = None
+    while True:
+        group = [_writes.get()]
+        while len(group) < WRITE_GROUP_SIZE:
+            try:
+                group.append(_writes.get_nowait())
+            except queue.Empty:
+                break
+        _commit_group(conn, [job for job in group if job[3].set_running_or_notify_cancel()])
+
+def _commit_group(conn, group):
+    done = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for fn, args, kwargs, future in group:
+            conn.execute("SAVEPOINT write_job")
+            try:
+                result = fn(conn, *args, **kwargs)
+            except Exception as e:
+                conn.execute("ROLLBACK TO write_job")
+                conn.execute("RELEASE write_job")
+                future.set_exception(e)
+                continue
+            conn.execute("RELEASE write_job")
+            done.append((future, result))
+        conn.execute("COMMIT")
+    except Exception as e:
+        print(f"Write group failed: {e}")
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        # Nothing in the group was committed, including the writes that had succeeded
+        for _, _, _, future in group:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for future, result in done:
+        future.set_result(result)
+
 def init_db():
     conn = get_db_connection()
     c = conn.cursor()
@@ -53,6 +242,8 @@ def init_db():
         )
     ''')
 
+    # The unique (platform, platform_id) index is created by the _unique_platform_entries migration
+
     # User explicit ratings
     # Separate table to allow simple updating
     c.execute('''
@@ -86,22 +277,462 @@ def init_db():
         )
     ''')
     
+    # Interned tag vocabulary (genre, theme, keyword, developer and mode names)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    # Game <-> tag association, replaces parsing the JSON tag columns on read
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS game_tags (
+            game_id INTEGER NOT NULL, -- FK to games.id
+            tag_kind TEXT NOT NULL, -- one of TAG_KINDS
+            tag_id INTEGER NOT NULL, -- FK to tags.id
+            position INTEGER DEFAULT 0, -- order within the source list
+            PRIMARY KEY (game_id, tag_kind, tag_id),
+            FOREIGN KEY (game_id) REFERENCES games (id),
+            FOREIGN KEY (tag_id) REFERENCES tags (id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_game_tags_kind_tag ON game_tags (tag_kind, tag_id)")
+
+    # Local copy of IGDB's similar_games graph (edges + per-source fetch time for the TTL)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS similar_games (
+            source_igdb_id INTEGER NOT NULL,
+            similar_igdb_id INTEGER NOT NULL,
+            position INTEGER DEFAULT 0, -- order as returned by IGDB
+            PRIMARY KEY (source_igdb_id, similar_igdb_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS similar_games_fetched (
+            source_igdb_id INTEGER PRIMARY KEY,
+            fetched_at REAL NOT NULL -- unix timestamp
+        )
+    ''')
+
+    # Cached IGDB metadata for recommendation candidates (games we don't own)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS igdb_catalog (
+            igdb_id INTEGER PRIMARY KEY,
+            name TEXT, -- NULL if IGDB returned nothing for this id
+            summary TEXT,
+            rating REAL,
+            genres TEXT, -- JSON list of {"id", "name"} as returned by IGDB
+            cover_image_id TEXT,
+            platforms TEXT, -- JSON list of IGDB platform ids
+            fetched_at REAL NOT NULL -- unix timestamp
+        )
+    ''')
+
+    # CheapShark price cache (see pricing.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS cheapshark_titles (
+            normalized_title TEXT PRIMARY KEY,
+            game_id TEXT, -- CheapShark gameID, NULL if the search found nothing
+            fetched_at REAL NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS cheapshark_prices (
+            game_id TEXT PRIMARY KEY,
+            prices TEXT, -- JSON {"Steam": "9.99", "Best Deal": "4.99"}
+            fetched_at REAL NOT NULL
+        )
+    ''')
+
+    # Per-platform sync watermarks (see ingest.py): incremental syncs only process titles
+    # played or added since the cursor, with a periodic full reconcile
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            platform TEXT PRIMARY KEY,
+            last_sync REAL, -- unix timestamp of the last successful sync
+            last_full_sync REAL,
+            cursor TEXT -- platform-specific position, e.g. newest last-played time seen
+        )
+    ''')
+
+    # Titles IGDB search found nothing for, retried with exponential backoff (see igdb.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS igdb_misses (
+            normalized_title TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL,
+            last_attempt REAL NOT NULL, -- unix timestamp
+            retry_after REAL NOT NULL
+        )
+    ''')
+
+    # Persisted taste profile, maintained incrementally by user_profile.py
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS profile_tags (
+            kind TEXT NOT NULL, -- 'genres', 'disliked_genres', 'negative_keywords', ...
+            name TEXT NOT NULL,
+            score REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, name)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS profile_games (
+            game_id INTEGER PRIMARY KEY, -- FK to games.id
+            like_weight REAL DEFAULT 0,
+            dislike_weight REAL DEFAULT 0,
+            ignored INTEGER DEFAULT 0, -- dismissed as 'not_interested'
+            total_minutes INTEGER DEFAULT 0,
+            max_playtime INTEGER DEFAULT 0,
+            entries INTEGER DEFAULT 0 -- linked user_library rows
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_profile_games_max_playtime ON profile_games (max_playtime)")
+    c.execute("CREATE TABLE IF NOT EXISTS profile_meta (key TEXT PRIMARY KEY, value REAL)")
+    c.execute("CREATE TABLE IF NOT EXISTS profile_dirty (game_id INTEGER PRIMARY KEY)")
+
+    # Queue games whose profile contribution may have changed
+    profile_triggers = {
+        'user_library_profile_insert': ("AFTER INSERT ON user_library", "SELECT NEW.game_id WHERE NEW.game_id IS NOT NULL"),
+        'user_library_profile_delete': ("AFTER DELETE ON user_library", "SELECT OLD.game_id WHERE OLD.game_id IS NOT NULL"),
+        'user_library_profile_update': ("AFTER UPDATE OF game_id, playtime_minutes ON user_library",
+                                        "SELECT OLD.game_id WHERE OLD.game_id IS NOT NULL UNION SELECT NEW.game_id WHERE NEW.game_id IS NOT NULL"),
+        'ratings_profile_insert': ("AFTER INSERT ON ratings", "SELECT NEW.game_id"),
+        'ratings_profile_update': ("AFTER UPDATE ON ratings", "SELECT OLD.game_id UNION SELECT NEW.game_id"),
+        'ratings_profile_delete': ("AFTER DELETE ON ratings", "SELECT OLD.game_id"),
+        'ignored_profile_insert': ("AFTER INSERT ON ignored_recommendations", "SELECT id FROM games WHERE igdb_id = NEW.igdb_id"),
+        'ignored_profile_update': ("AFTER UPDATE ON ignored_recommendations", "SELECT id FROM games WHERE igdb_id IN (OLD.igdb_id, NEW.igdb_id)"),
+        'ignored_profile_delete': ("AFTER DELETE ON ignored_recommendations", "SELECT id FROM games WHERE igdb_id = OLD.igdb_id"),
+        'games_profile_insert': ("AFTER INSERT ON games",
+                                 "SELECT NEW.id WHERE EXISTS (SELECT 1 FROM ignored_recommendations WHERE igdb_id = NEW.igdb_id)"),
+    }
+    for name, (event, select) in profile_triggers.items():
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} {event}
+            BEGIN
+                INSERT OR IGNORE INTO profile_dirty (game_id) {select};
+            END
+        ''')
+
+    # Backfill from the JSON columns for databases created before game_tags existed
+    if c.execute("SELECT 1 FROM game_tags LIMIT 1").fetchone() is None:
+        backfill_game_tags(conn)
+
+    # Change counters, bumped by triggers so every writer (web, ingest, CLI)
+    # invalidates long-lived caches such as the shared RecommenderEngine.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table, columns in VERSIONED_TABLES.items():
+        c.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)", (table,))
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            event = f"UPDATE OF {columns}" if op == 'UPDATE' and columns else op
+            c.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{op.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+    
+    run_migrations(conn)
     conn.commit()
+    # Seed the planner statistics once; PRAGMA optimize keeps them current from then on
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        conn.execute("ANALYZE")
+        conn.commit()
     conn.close()
     print(f"Database initialized at {DB_PATH}")
 
+# --- Migrations ---
+# Schema changes to tables that already exist go here rather than in the CREATE TABLEs above.
+# PRAGMA user_version holds how many have been applied; init_db runs the rest, in order.
+
+def _add_column(conn, table, column, decl):
+    # Some databases got these columns from older ad-hoc ALTERs, so check before adding
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _add_missing_columns(conn):
+    """Columns the code has been reading and writing without init_db ever creating them."""
+    _add_column(conn, 'games', 'developers', 'TEXT') # JSON list of strings
+    _add_column(conn, 'games', 'game_modes', 'TEXT') # JSON list of strings
+    _add_column(conn, 'user_library', 'hidden_from_analysis', 'INTEGER DEFAULT 0')
+    _add_column(conn, 'ignored_recommendations', 'reason', "TEXT DEFAULT 'not_interested'")
+
+def _add_lookup_indexes(conn):
+    """Indexes for the library/game joins and title lookups.
+    user_library (platform, platform_id) and ratings (game_id) are covered by their unique indexes
+    (see _unique_platform_entries)."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_library_game_id ON user_library (game_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_games_normalized_title ON games (normalized_title)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_games_title ON games (title)")
+
+def _add_library_search(conn):
+    """FTS5 index for the library search box: one row per user_library entry (same rowid),
+    with the linked game's title, normalized title and developers. Kept current by triggers."""
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS library_search USING fts5(
+            original_title, golden_title, normalized_title, developers,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3' -- search-as-you-type queries are short prefixes
+        )
+    ''')
+    index_entry = '''
+        INSERT INTO library_search (rowid, original_title, golden_title, normalized_title, developers)
+        SELECT NEW.id, NEW.original_title, g.title, g.normalized_title, g.developers
+        FROM (SELECT NEW.game_id AS game_id) e
+        LEFT JOIN games g ON g.id = e.game_id;
+    '''
+    triggers = {
+        'library_search_insert': ("AFTER INSERT ON user_library", index_entry),
+        'library_search_update': ("AFTER UPDATE OF original_title, game_id ON user_library",
+                                  "DELETE FROM library_search WHERE rowid = OLD.id;" + index_entry),
+        'library_search_delete': ("AFTER DELETE ON user_library", "DELETE FROM library_search WHERE rowid = OLD.id;"),
+        'library_search_game_update': ("AFTER UPDATE OF title, normalized_title, developers ON games", '''
+            UPDATE library_search
+            SET golden_title = NEW.title, normalized_title = NEW.normalized_title, developers = NEW.developers
+            WHERE rowid IN (SELECT id FROM user_library WHERE game_id = NEW.id);
+        '''),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    conn.execute("DELETE FROM library_search")
+    conn.execute('''
+        INSERT INTO library_search (rowid, original_title, golden_title, normalized_title, developers)
+        SELECT ul.id, ul.original_title, g.title, g.normalized_title, g.developers
+        FROM user_library ul
+        LEFT JOIN games g ON g.id = ul.game_id
+    ''')
+
+def _unique_platform_entries(conn):
+    """One row per platform entry; ingest.write_library_records upserts against this index.
+    Databases from before it existed may hold duplicates: keep the oldest row of each."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_user_library_platform_entry'").fetchone():
+        return
+    conn.execute('''
+        DELETE FROM user_library
+        WHERE platform_id IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM user_library GROUP BY platform, platform_id
+        )
+    ''')
+    conn.execute("CREATE UNIQUE INDEX idx_user_library_platform_entry ON user_library (platform, platform_id)")
+
+def _library_group_sql(key, platform):
+    """Recomputes one group of library_groups, in the 'all' scope and in its platform's scope."""
+    # The primary entry is the one with the most playtime (oldest first on ties)
+    return f'''
+        DELETE FROM library_groups WHERE group_key = {key} AND scope IN ('all', {platform});
+        INSERT INTO library_groups (scope, group_key, primary_id, playtime_minutes, platforms, last_played, title_key, rating)
+        SELECT s.scope, {key}, p.id, s.playtime_minutes, s.platforms, s.last_played, LOWER(p.original_title),
+               COALESCE((SELECT rating FROM ratings WHERE game_id = {key}), 0)
+        FROM (
+            SELECT 'all' AS scope, COUNT(*) AS entries, SUM(COALESCE(playtime_minutes, 0)) AS playtime_minutes,
+                   GROUP_CONCAT(DISTINCT platform) AS platforms, COALESCE(MAX(last_played), '') AS last_played
+            FROM user_library WHERE COALESCE(game_id, -id) = {key}
+            UNION ALL
+            SELECT {platform}, COUNT(*), SUM(COALESCE(playtime_minutes, 0)), {platform}, COALESCE(MAX(last_played), '')
+            FROM user_library WHERE COALESCE(game_id, -id) = {key} AND platform = {platform}
+        ) s
+        JOIN user_library p ON p.id = (
+            SELECT id FROM user_library
+            WHERE COALESCE(game_id, -id) = {key} AND (s.scope = 'all' OR platform = s.scope)
+            ORDER BY COALESCE(playtime_minutes, 0) DESC, id
+            LIMIT 1
+        )
+        WHERE s.entries > 0;
+    '''
+
+def _add_library_groups(conn):
+    """The library grid's rows, kept current by triggers so pages don't regroup the whole library.
+    Entries linked to the same game form one group (unmatched entries are their own group, keyed by -id),
+    once over all platforms (scope 'all') and once per platform (scope = platform). Each group has its
+    summed playtime, platform list, latest play and the primary entry's title and rating as sort keys."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS library_groups (
+            scope TEXT NOT NULL, -- 'all' or a platform
+            group_key INTEGER NOT NULL, -- game_id, or -user_library.id for unmatched entries
+            primary_id INTEGER NOT NULL, -- user_library entry shown for the group
+            playtime_minutes INTEGER NOT NULL,
+            platforms TEXT NOT NULL, -- comma separated
+            last_played TEXT NOT NULL, -- '' when never played
+            title_key TEXT NOT NULL, -- lowercased title of the primary entry
+            rating INTEGER NOT NULL, -- 0 when unrated
+            PRIMARY KEY (group_key, scope)
+        ) WITHOUT ROWID
+    ''')
+    # One index per sort, so a page is a range scan from the keyset cursor
+    for column in ('playtime_minutes', 'title_key', 'rating', 'last_played'):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_library_groups_{column} ON library_groups (scope, {column}, primary_id)")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_library_groups_unmatched ON library_groups (scope, playtime_minutes, primary_id)
+        WHERE group_key < 0
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_library_group ON user_library (COALESCE(game_id, -id), platform)")
+
+    old_group = _library_group_sql("COALESCE(OLD.game_id, -OLD.id)", "OLD.platform")
+    new_group = _library_group_sql("COALESCE(NEW.game_id, -NEW.id)", "NEW.platform")
+    rating = '''
+        UPDATE library_groups SET rating = COALESCE((SELECT rating FROM ratings WHERE game_id = {0}.game_id), 0)
+        WHERE group_key = {0}.game_id;
+    '''
+    triggers = {
+        'library_groups_insert': ("AFTER INSERT ON user_library", new_group),
+        'library_groups_update': ("AFTER UPDATE OF game_id, platform, playtime_minutes, last_played, original_title ON user_library",
+                                  old_group + new_group),
+        'library_groups_delete': ("AFTER DELETE ON user_library", old_group),
+        'library_groups_rating_insert': ("AFTER INSERT ON ratings", rating.format('NEW')),
+        'library_groups_rating_update': ("AFTER UPDATE ON ratings", rating.format('OLD') + rating.format('NEW')),
+        'library_groups_rating_delete': ("AFTER DELETE ON ratings", rating.format('OLD')),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    conn.execute("DELETE FROM library_groups")
+    conn.execute('''
+        WITH entries AS (
+            SELECT id, platform, original_title, COALESCE(playtime_minutes, 0) AS playtime,
+                   COALESCE(last_played, '') AS last_played, COALESCE(game_id, -id) AS group_key
+            FROM user_library
+        ),
+        scoped AS (
+            SELECT 'all' AS scope, * FROM entries
+            UNION ALL
+            SELECT platform, * FROM entries
+        ),
+        ranked AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY scope, group_key ORDER BY playtime DESC, id) AS n FROM scoped
+        )
+        INSERT INTO library_groups (scope, group_key, primary_id, playtime_minutes, platforms, last_played, title_key, rating)
+        SELECT e.scope, e.group_key, p.id, SUM(e.playtime), GROUP_CONCAT(DISTINCT e.platform), MAX(e.last_played),
+               LOWER(p.original_title), COALESCE((SELECT rating FROM ratings WHERE game_id = e.group_key), 0)
+        FROM ranked e
+        JOIN ranked p ON p.scope = e.scope AND p.group_key = e.group_key AND p.n = 1
+        GROUP BY e.scope, e.group_key
+    ''')
+
+def _add_backlog_index(conn):
+    """Lets the backlog query (recommend.BACKLOG_QUERY) find unplayed entries without scanning the library."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_library_status ON user_library (manual_play_status, game_id)")
+
+MIGRATIONS = [
+    _add_missing_columns,
+    _add_lookup_indexes,
+    _add_library_search,
+    _unique_platform_entries,
+    _add_library_groups,
+    _add_backlog_index,
+]
+
+def run_migrations(conn):
+    """Applies the migrations this database hasn't seen yet. Commits after each one."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+        migrate(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+        print(f"Applied migration {number}: {migrate.__name__}")
+
+def get_data_versions(conn=None):
+    """Returns a hashable snapshot of the change counters in data_versions."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT name, version FROM data_versions ORDER BY name").fetchall()
+        return tuple((r['name'], r['version']) for r in rows)
+    except sqlite3.OperationalError:
+        # Table not created yet (init_db not run)
+        return None
+    finally:
+        if own_conn:
+            conn.close()
+
+def set_game_tags(conn, game_id, game_data):
+    """
+    Replaces the game_tags rows of a game with the tag lists in game_data.
+    game_data uses the same keys as the IGDB dicts (genres, themes, ...), each a list of names.
+    Does not commit; callers write it in the same transaction as the games row.
+    """
+    from user_profile import retract_game
+    # The profile aggregates are keyed by tag, so take the old tags out first
+    retract_game(conn, game_id)
+
+    names = {name for kind in TAG_KINDS for name in (game_data.get(kind) or [])}
+    tag_ids = {}
+    if names:
+        conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(n,) for n in names])
+        for chunk in chunks(list(names)):
+            placeholders = ','.join('?' * len(chunk))
+            for row in conn.execute(f"SELECT id, name FROM tags WHERE name IN ({placeholders})", chunk):
+                tag_ids[row[1]] = row[0]
+
+    conn.execute("DELETE FROM game_tags WHERE game_id = ?", (game_id,))
+    rows = []
+    for kind in TAG_KINDS:
+        for pos, name in enumerate(game_data.get(kind) or []):
+            rows.append((game_id, kind, tag_ids[name], pos))
+    conn.executemany(
+        "INSERT OR IGNORE INTO game_tags (game_id, tag_kind, tag_id, position) VALUES (?, ?, ?, ?)", rows
+    )
+
+def get_game_tags(conn, game_ids):
+    """
+    Returns {game_id: {kind: [names in original order]}} for the given games.
+    Games without tags still get an entry with empty lists.
+    """
+    result = {gid: {kind: [] for kind in TAG_KINDS} for gid in game_ids}
+    for chunk in chunks(list(result)):
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(f'''
+            SELECT gt.game_id, gt.tag_kind, t.name
+            FROM game_tags gt
+            JOIN tags t ON t.id = gt.tag_id
+            WHERE gt.game_id IN ({placeholders})
+            ORDER BY gt.game_id, gt.tag_kind, gt.position
+        ''', chunk)
+        for row in rows:
+            result[row[0]][row[1]].append(row[2])
+    return result
+
+def backfill_game_tags(conn):
+    """Populates game_tags from the legacy JSON tag columns."""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(games)")}
+    kinds = [k for k in TAG_KINDS if k in existing]
+    if not kinds:
+        return
+    rows = conn.execute(f"SELECT id, {', '.join(kinds)} FROM games").fetchall()
+    for row in rows:
+        game_data = {}
+        for kind in kinds:
+            try:
+                game_data[kind] = json.loads(row[kind]) if row[kind] else []
+            except (json.JSONDecodeError, TypeError):
+                game_data[kind] = []
+        set_game_tags(conn, row['id'], game_data)
+
+def chunks(items, size=500):
+    # Stay well under SQLite's bound-parameter limit
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
 def save_game_details(game_data):
     """
     Updates or inserts a game with detailed metadata including developers and modes.
     Intended to be used when refetching data.
     """
+    # We rely on IGDB ID to match
+    if not game_data.get('id'): return
+    write(_save_game_details, game_data)
+
+def _save_game_details(conn, game_data):
     from utils import normalize_title
-    conn = get_db_connection()
     c = conn.cursor()
-    
-    # We rely on IGDB ID to match
     igdb_id = game_data.get('id')
-    if not igdb_id: return
 
     genres = json.dumps(game_data.get('genres', []))
     themes = json.dumps(game_data.get('themes', []))
@@ -128,15 +759,16 @@ def save_game_details(game_data):
                 total_rating = ?, total_rating_count = ?
             WHERE igdb_id = ?
         ''', (developers, modes, genres, themes, keywords, total_rating, total_rating_count, igdb_id))
+        game_db_id = row['id']
     else:
         # Insert
         c.execute('''
             INSERT INTO games (igdb_id, title, normalized_title, genres, themes, keywords, summary, cover_url, total_rating, total_rating_count, developers, game_modes)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (igdb_id, title, normalized, genres, themes, keywords, summary, cover, total_rating, total_rating_count, developers, modes))
-        
-    conn.commit()
-    conn.close()
+        game_db_id = c.lastrowid
+
+    set_game_tags(conn, game_db_id, game_data)
 
 def get_game_details(title):
     from utils import normalize_title
@@ -148,20 +780,13 @@ def get_game_details(title):
     
     c.execute("SELECT * FROM games WHERE normalized_title = ? OR title = ?", (norm, title))
     row = c.fetchone()
-    conn.close()
     
     if row:
         d = dict(row)
-        # Deserialize
-        for k in ['genres', 'themes', 'keywords', 'developers', 'game_modes']:
-            if k in d and d[k]:
-                try:
-                    d[k] = json.loads(d[k])
-                except:
-                    d[k] = []
-            else:
-                d[k] = []
+        d.update(get_game_tags(conn, [row['id']])[row['id']])
+        conn.close()
         return d
+    conn.close()
     return None
 
 if __name__ == '__main__':
@@ -1,11 +1,11 @@
-import requests
 from datetime import datetime
+import http_client
 
 def get_free_games():
     """Fetches current free games from Epic Games Store."""
     url = "https://store-site-backend-static.ak.epicgames.com/freeGamesPromotions"
     try:
-        response = requests.get(url, timeout=10)
+        response = http_client.get('epic', url, timeout=10)
         data = response.json()
         
         games = data['data']['Catalog']['searchStore']['elements']
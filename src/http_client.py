@@ -0,0 +1,130 @@
+import time
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from pyrate_limiter import Limiter, Rate, Duration
+
+# Shared outbound HTTP layer.
+# Every API call goes through request(): one pooled keep-alive session per host, a token bucket
+# and a concurrency cap per API, retry with backoff on 429/5xx, and per-endpoint counters.
+
+# API -> (requests per second, max requests in flight)
+API_LIMITS = {
+    'igdb': (4, 8),        # IGDB: 4 req/s and at most 8 open requests
+    'twitch': (1, 1),      # OAuth token endpoint
+    'cheapshark': (4, 4),
+    'steam': (10, 4),
+    'gog': (4, 4),
+    'epic': (2, 2),
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 30
+DEFAULT_TIMEOUT = 30
+# Keep-alive connections kept per host
+POOL_SIZE = 10
+
+# Raised when a request times out, so callers don't need to import requests
+Timeout = requests.exceptions.Timeout
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+_limiters = {
+    api: Limiter(Rate(rate, Duration.SECOND), raise_when_fail=False, max_delay=Duration.MINUTE)
+    for api, (rate, _) in API_LIMITS.items()
+}
+_slots = {api: threading.BoundedSemaphore(cap) for api, (_, cap) in API_LIMITS.items()}
+
+_stats = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0, 'throttled': 0, 'seconds': 0.0})
+_stats_lock = threading.Lock()
+
+def _session(host):
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[host] = session
+        return session
+
+def _record(endpoint, seconds, error=False, retried=False, throttled=False):
+    with _stats_lock:
+        s = _stats[endpoint]
+        s['calls'] += 1
+        s['seconds'] += seconds
+        s['errors'] += int(error)
+        s['retries'] += int(retried)
+        s['throttled'] += int(throttled)
+
+def _backoff(resp, attempt):
+    # Honour Retry-After when the server sends seconds, otherwise back off exponentially
+    retry_after = resp.headers.get('Retry-After') if resp is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(int(retry_after), MAX_BACKOFF)
+    return min(BACKOFF_BASE * 2 ** attempt, MAX_BACKOFF)
+
+def _acquire(limiter, api):
+    # try_acquire returns False instead of waiting past max_delay (e.g. many threads queued on one bucket);
+    # the request must still wait for its token, so keep trying
+    while not limiter.try_acquire(api):
+        time.sleep(BACKOFF_BASE)
+
+def request(api, method, url, **kwargs):
+    """
+    Sends a request for the given API (a key of API_LIMITS), waiting for its rate limit and a free slot.
+    Retries 429/5xx responses and connection errors; returns the last response or re-raises the last error.
+    """
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    parsed = urlparse(url)
+    endpoint = f"{api} {parsed.path}"
+    session = _session(parsed.netloc)
+    limiter, slots = _limiters[api], _slots[api]
+
+    for attempt in range(MAX_RETRIES + 1):
+        _acquire(limiter, api)
+        start = time.perf_counter()
+        resp = error = None
+        with slots:
+            try:
+                resp = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+        last = attempt == MAX_RETRIES
+        retry = (error is not None or resp.status_code in RETRY_STATUSES) and not last
+        _record(endpoint, time.perf_counter() - start,
+                error=error is not None or resp.status_code >= 400,
+                retried=retry,
+                throttled=resp is not None and resp.status_code == 429)
+        if not retry:
+            if error is not None:
+                raise error
+            return resp
+        time.sleep(_backoff(resp, attempt))
+
+def get(api, url, **kwargs):
+    return request(api, 'GET', url, **kwargs)
+
+def post(api, url, **kwargs):
+    return request(api, 'POST', url, **kwargs)
+
+def get_stats():
+    """Per-endpoint counters: {'igdb /v4/games': {'calls', 'errors', 'retries', 'throttled', 'avg_ms'}}."""
+    with _stats_lock:
+        return {
+            endpoint: {
+                'calls': s['calls'],
+                'errors': s['errors'],
+                'retries': s['retries'],
+                'throttled': s['throttled'],
+                'avg_ms': round(s['seconds'] / s['calls'] * 1000, 1) if s['calls'] else 0.0,
+            }
+            for endpoint, s in sorted(_stats.items())
+        }
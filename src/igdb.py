@@ -1,13 +1,60 @@
 import os
-import requests
 import time
 import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from db import get_db_connection
+import http_client
+from db import get_db_connection, set_game_tags, chunks, write
 from utils import normalize_title
 
 load_dotenv()
 
+GAME_FIELDS = """fields name, genres.name, themes.name, keywords.name, summary, cover.url, total_rating, rating,
+        involved_companies.company.name, involved_companies.developer, game_modes.name;"""
+
+# IGDB accepts up to 10 queries per multiquery request
+MULTIQUERY_SIZE = 10
+# Multiquery batches in flight; throughput is capped by http_client's IGDB limiter
+MULTIQUERY_WORKERS = 4
+
+# Titles IGDB can't match (demos, tools, soundtracks...) are retried after 1, 2, 4... days, at most every 90
+MISS_BACKOFF = 24 * 3600
+MISS_BACKOFF_MAX = 90 * 24 * 3600
+
+# user_library.platform -> IGDB external game source whose uid is our platform_id.
+# Xbox title ids are not what IGDB stores (it keys Microsoft by store product id), so Xbox uses title search.
+EXTERNAL_GAME_SOURCES = {
+    'steam': 1,
+    'gog': 5,
+}
+
+def format_game(game):
+    """Flattens an IGDB game response into the dict the analyzer and sync use."""
+    # Process Developers (Extract only companies marked as 'developer')
+    developers = []
+    if 'involved_companies' in game:
+        for comp in game['involved_companies']:
+            if comp.get('developer', False):
+                developers.append(comp['company']['name'])
+
+    # Process Game Modes
+    modes = [m['name'] for m in game.get('game_modes', [])]
+
+    return {
+        "id": game.get("id"),
+        "title": game.get("name"),
+        "genres": [g["name"] for g in game.get("genres", [])] if game.get("genres") else [],
+        "themes": [t["name"] for t in game.get("themes", [])] if game.get("themes") else [],
+        "keywords": [k["name"] for k in game.get("keywords", [])] if game.get("keywords") else [],
+        "cover": game.get("cover"),
+        "rating": game.get("rating"),
+        "total_rating": game.get("total_rating"),
+        "description": game.get("summary"),
+        "developers": developers,
+        "game_modes": modes
+    }
+
 class IGDBClient:
     def __init__(self):
         self.client_id = os.getenv("TWITCH_CLIENT_ID")
@@ -30,7 +77,7 @@ class IGDBClient:
             "grant_type": "client_credentials"
         }
         try:
-            resp = requests.post(url, params=params)
+            resp = http_client.post('twitch', url, params=params)
             resp.raise_for_status()
             data = resp.json()
             self.access_token = data['access_token']
@@ -55,46 +102,17 @@ class IGDBClient:
         # Fields: We need enough to profile the game
         # Added: involved_companies (filter for developer=true) and game_modes
         body = f'''
-        fields name, genres.name, themes.name, keywords.name, summary, cover.url, total_rating, rating,
-        involved_companies.company.name, involved_companies.developer, game_modes.name;
+        {GAME_FIELDS}
         search "{query_title}";
         limit 1;
         '''
         
         try:
-            resp = requests.post(url, headers=headers, data=body)
-            if resp.status_code == 429:
-                time.sleep(1)
-                return self.search_game(query_title)
-                
+            resp = http_client.post('igdb', url, headers=headers, data=body)
             resp.raise_for_status()
             data = resp.json()
             if data:
-                game = data[0]
-                
-                # Process Developers (Extract only companies marked as 'developer')
-                developers = []
-                if 'involved_companies' in game:
-                    for comp in game['involved_companies']:
-                        if comp.get('developer', False):
-                            developers.append(comp['company']['name'])
-                
-                # Process Game Modes
-                modes = [m['name'] for m in game.get('game_modes', [])]
-
-                return {
-                    "id": game.get("id"),
-                    "title": game.get("name"),
-                    "genres": [g["name"] for g in game.get("genres", [])] if game.get("genres") else [],
-                    "themes": [t["name"] for t in game.get("themes", [])] if game.get("themes") else [],
-                    "keywords": [k["name"] for k in game.get("keywords", [])] if game.get("keywords") else [],
-                    "cover": game.get("cover"),
-                    "rating": game.get("rating"),
-                    "total_rating": game.get("total_rating"),
-                    "description": game.get("summary"),
-                    "developers": developers,  # New Field
-                    "game_modes": modes        # New Field
-                }
+                return format_game(data[0])
             return None
         except Exception as e:
             print(f"IGDB Search Error: {e}")
@@ -111,44 +129,17 @@ class IGDBClient:
         }
         
         body = f'''
-        fields name, genres.name, themes.name, keywords.name, summary, cover.url, total_rating, rating,
-        involved_companies.company.name, involved_companies.developer, game_modes.name;
+        {GAME_FIELDS}
         where id = {game_id};
         limit 1;
         '''
         
         try:
-            resp = requests.post(url, headers=headers, data=body)
-            if resp.status_code == 429:
-                time.sleep(1)
-                return self.get_game_by_id(game_id)
-                
+            resp = http_client.post('igdb', url, headers=headers, data=body)
             resp.raise_for_status()
             data = resp.json()
             if data:
-                game = data[0]
-                
-                developers = []
-                if 'involved_companies' in game:
-                    for comp in game['involved_companies']:
-                        if comp.get('developer', False):
-                            developers.append(comp['company']['name'])
-                
-                modes = [m['name'] for m in game.get('game_modes', [])]
-
-                return {
-                    "id": game.get("id"),
-                    "title": game.get("name"),
-                    "genres": [g["name"] for g in game.get("genres", [])] if game.get("genres") else [],
-                    "themes": [t["name"] for t in game.get("themes", [])] if game.get("themes") else [],
-                    "keywords": [k["name"] for k in game.get("keywords", [])] if game.get("keywords") else [],
-                    "cover": game.get("cover"),
-                    "rating": game.get("rating"),
-                    "total_rating": game.get("total_rating"),
-                    "description": game.get("summary"),
-                    "developers": developers,
-                    "game_modes": modes
-                }
+                return format_game(data[0])
             return None
         except Exception as e:
             print(f"IGDB Search Error: {e}")
@@ -165,52 +156,248 @@ class IGDBClient:
         }
         
         body = f'''
-        fields name, genres.name, themes.name, keywords.name, summary, cover.url, total_rating, rating,
-        involved_companies.company.name, involved_companies.developer, game_modes.name;
+        {GAME_FIELDS}
         where id = {igdb_id};
         '''
         
         try:
-            resp = requests.post(url, headers=headers, data=body)
+            resp = http_client.post('igdb', url, headers=headers, data=body)
             resp.raise_for_status()
             data = resp.json()
             if data:
-                game = data[0]
-                
-                # Process Developers
-                developers = []
-                if 'involved_companies' in game:
-                    for comp in game['involved_companies']:
-                        if comp.get('developer', False):
-                            developers.append(comp['company']['name'])
-                
-                # Process Modes
-                modes = [m['name'] for m in game.get('game_modes', [])]
-                
-                return {
-                    "id": game.get("id"),
-                    "title": game.get("name"),
-                    "genres": [g["name"] for g in game.get("genres", [])] if game.get("genres") else [],
-                    "themes": [t["name"] for t in game.get("themes", [])] if game.get("themes") else [],
-                    "keywords": [k["name"] for k in game.get("keywords", [])] if game.get("keywords") else [],
-                    "cover": game.get("cover"),
-                    "rating": game.get("rating"),
-                    "total_rating": game.get("total_rating"),
-                    "description": game.get("summary"),
-                    "developers": developers,
-                    "game_modes": modes
-                }
+                return format_game(data[0])
             return None
         except Exception as e:
             print(f"IGDB Fetch Error: {e}")
             return None
 
-def sync_library_metadata():
+    def get_games_by_ids(self, igdb_ids):
+        """Fetches many games in one request per 500 ids. Returns {igdb_id: game}."""
+        if not igdb_ids or not self.authenticate():
+            return {}
+
+        url = "https://api.igdb.com/v4/games"
+        headers = {
+            "Client-ID": self.client_id,
+            "Authorization": f"Bearer {self.access_token}"
+        }
+
+        games = {}
+        for chunk in chunks(list(igdb_ids)):
+            body = f'''
+            {GAME_FIELDS}
+            where id = ({','.join(str(i) for i in chunk)});
+            limit {len(chunk)};
+            '''
+            try:
+                resp = http_client.post('igdb', url, headers=headers, data=body)
+                resp.raise_for_status()
+                for game in resp.json():
+                    games[game['id']] = format_game(game)
+            except Exception as e:
+                print(f"IGDB Fetch Error: {e}")
+        return games
+
+    def resolve_external_ids(self, source, uids):
+        """Maps platform ids to IGDB game ids through external_games, 500 uids per request. Returns {uid: igdb_id}."""
+        if not uids or not self.authenticate():
+            return {}
+
+        url = "https://api.igdb.com/v4/external_games"
+        headers = {
+            "Client-ID": self.client_id,
+            "Authorization": f"Bearer {self.access_token}"
+        }
+
+        resolved = {}
+        for chunk in chunks(list(uids)):
+            uid_list = ','.join(json.dumps(str(u)) for u in chunk)
+            body = f'fields game, uid; where external_game_source = {source} & uid = ({uid_list}); limit 500;'
+            try:
+                resp = http_client.post('igdb', url, headers=headers, data=body)
+                resp.raise_for_status()
+                for row in resp.json():
+                    if row.get('game') and row.get('uid'):
+                        resolved.setdefault(row['uid'], row['game'])
+            except Exception as e:
+                print(f"IGDB External Lookup Error: {e}")
+        return resolved
+
+    def _multiquery_search(self, titles):
+        """
+        Runs up to MULTIQUERY_SIZE title searches in one /v4/multiquery request.
+        Returns {title: game or None}, or {} if the request failed.
+        """
+        url = "https://api.igdb.com/v4/multiquery"
+        headers = {
+            "Client-ID": self.client_id,
+            "Authorization": f"Bearer {self.access_token}"
+        }
+
+        # Each sub-query is named by its index in the batch
+        body = ''
+        for i, title in enumerate(titles):
+            escaped = title.replace('"', '\\"')
+            body += f'''
+        query games "{i}" {{
+            {GAME_FIELDS}
+            search "{escaped}";
+            limit 1;
+        }};
+        '''
+
+        results = {title: None for title in titles}
+        try:
+            resp = http_client.post('igdb', url, headers=headers, data=body)
+            resp.raise_for_status()
+            for entry in resp.json():
+                if entry.get('result'):
+                    results[titles[int(entry['name'])]] = format_game(entry['result'][0])
+        except Exception as e:
+            # Failed batches come back empty so callers don't mistake them for "no match"
+            print(f"IGDB Search Error: {e}")
+            return {}
+        return results
+
+    def _search_batch(self, titles):
+        # One retry, so a transient error doesn't skip the batch until the next sync
+        return self._multiquery_search(titles) or self._multiquery_search(titles)
+
+    def iter_search_games(self, titles):
+        """
+        Searches many titles with multiquery batches run concurrently (paced by the shared IGDB limiter).
+        Yields (titles, {title: game or None}) per batch as batches complete; the dict is {} if the batch
+        failed twice.
+        """
+        titles = list(dict.fromkeys(titles))
+        if not titles or not self.authenticate():
+            return
+        batches = [titles[i:i + MULTIQUERY_SIZE] for i in range(0, len(titles), MULTIQUERY_SIZE)]
+        with ThreadPoolExecutor(max_workers=MULTIQUERY_WORKERS) as pool:
+            futures = {pool.submit(self._search_batch, batch): batch for batch in batches}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                # Caller stopped early: drop the batches that haven't started
+                for future in futures:
+                    future.cancel()
+
+    def search_games(self, titles):
+        """Searches many titles at once. Returns {title: game or None}."""
+        results = {title: None for title in titles}
+        for _, batch_results in self.iter_search_games(titles):
+            results.update(batch_results)
+        return results
+
+def link_library_item(c, lib_id, match):
+    """Links a library entry to the IGDB match, inserting the game if it's new. Returns False without a match."""
+    if not match:
+        return False
+
+    igdb_id = match['id']
+
+    c.execute("SELECT id FROM games WHERE igdb_id = ?", (igdb_id,))
+    existing_game = c.fetchone()
+
+    if existing_game:
+        final_game_db_id = existing_game['id']
+    else:
+        # Safely get list names (They are already extracted as strings in format_game)
+        genres = json.dumps(match.get('genres', []))
+        themes = json.dumps(match.get('themes', []))
+        keywords = json.dumps(match.get('keywords', []))
+        developers = json.dumps(match.get('developers', []))
+        modes = json.dumps(match.get('game_modes', []))
+
+        cover = match.get('cover', {}).get('url', '') if isinstance(match.get('cover'), dict) else ''
+        normalized = normalize_title(match['title'])
+        total_rating = match.get('total_rating')
+        total_rating_count = match.get('total_rating_count')
+
+        c.execute('''
+            INSERT INTO games (igdb_id, title, normalized_title, genres, themes, keywords, summary, cover_url, total_rating, total_rating_count, developers, game_modes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (igdb_id, match['title'], normalized, genres, themes, keywords, match.get('description', ''), cover, total_rating, total_rating_count, developers, modes))
+        final_game_db_id = c.lastrowid
+        set_game_tags(c.connection, final_game_db_id, match)
+
+    # Link library item to game
+    c.execute("UPDATE user_library SET game_id = ? WHERE id = ?", (final_game_db_id, lib_id))
+    return True
+
+def record_title_misses(conn, titles):
+    """Records failed searches for normalized titles, doubling the wait before each one is retried."""
+    now = time.time()
+    conn.executemany('''
+        INSERT INTO igdb_misses (normalized_title, attempts, last_attempt, retry_after) VALUES (?, 1, ?, ?)
+        ON CONFLICT(normalized_title) DO UPDATE SET
+            attempts = attempts + 1,
+            last_attempt = excluded.last_attempt,
+            retry_after = excluded.last_attempt + MIN(? * (1 << attempts), ?)
+    ''', [(t, now, now + MISS_BACKOFF, MISS_BACKOFF, MISS_BACKOFF_MAX) for t in titles])
+
+def clear_title_misses(conn, titles):
+    """Forgets failed searches for these titles (raw or normalized), e.g. after a manual rematch."""
+    conn.executemany("DELETE FROM igdb_misses WHERE normalized_title = ?", [(normalize_title(t),) for t in titles])
+
+def link_by_platform_ids(conn, client, items):
+    """
+    Links library entries whose platform id IGDB knows (Steam appids, GOG product ids) without a title search.
+    Returns (linked count, entries left for title search).
+    """
+    by_uid = defaultdict(list)
+    for item in items:
+        source = EXTERNAL_GAME_SOURCES.get(item['platform'])
+        if source and item['platform_id']:
+            by_uid[(source, str(item['platform_id']))].append(item)
+    if not by_uid:
+        return 0, items
+
+    resolved = {}
+    for source in set(s for s, _ in by_uid):
+        uids = [uid for s, uid in by_uid if s == source]
+        for uid, igdb_id in client.resolve_external_ids(source, uids).items():
+            resolved[(source, uid)] = igdb_id
+    if not resolved:
+        return 0, items
+
+    c = conn.cursor()
+    igdb_ids = list(set(resolved.values()))
+    known = {}
+    for chunk in chunks(igdb_ids):
+        placeholders = ','.join('?' * len(chunk))
+        for row in c.execute(f"SELECT igdb_id, title FROM games WHERE igdb_id IN ({placeholders})", chunk):
+            known[row['igdb_id']] = {'id': row['igdb_id'], 'title': row['title']}
+    fetched = client.get_games_by_ids([i for i in igdb_ids if i not in known])
+
+    def link(conn):
+        c = conn.cursor()
+        linked = set()
+        for key, igdb_id in resolved.items():
+            match = known.get(igdb_id) or fetched.get(igdb_id)
+            if not match:
+                continue
+            for item in by_uid[key]:
+                link_library_item(c, item['id'], match)
+                linked.add(item['id'])
+                print(f"Matched: {item['original_title']} -> {match['title']} (by {item['platform']} id)")
+                clear_title_misses(conn, [item['original_title']])
+        return linked
+
+    linked = write(link)
+    return len(linked), [item for item in items if item['id'] not in linked]
+
+def sync_library_metadata(progress=None, should_stop=None):
+    """
+    Links unmatched library entries to IGDB games.
+    progress(matched, remaining) is called as batches complete; should_stop() is checked between batches.
+    """
     conn = get_db_connection()
     c = conn.cursor()
     
     # Get items without a linked Games ID
-    c.execute("SELECT id, original_title FROM user_library WHERE game_id IS NULL")
+    c.execute("SELECT id, platform, platform_id, original_title FROM user_library WHERE game_id IS NULL")
     items = c.fetchall()
     
     if not items:
@@ -226,55 +413,63 @@ def sync_library_metadata():
         return
     
     print(f"Found {len(items)} unmatched games. Querying IGDB...")
-    
-    count = 0
+
+    count, items = link_by_platform_ids(conn, client, items)
+
+    # Use normalized title for search to avoid issues with symbols or weird formatting.
+    # Entries sharing a title (same game on several platforms) are searched once.
+    by_query = defaultdict(list)
     for item in items:
-        lib_id = item['id']
-        title = item['original_title']
-        
-        # Use normalized title for search to avoid issues with symbols or weird formatting
-        search_query = normalize_title(title)
-        match = client.search_game(search_query)
-        
-        if match:
-            igdb_id = match['id']
-            
-            c.execute("SELECT id FROM games WHERE igdb_id = ?", (igdb_id,))
-            existing_game = c.fetchone()
-            
-            final_game_db_id = None
-            
-            if existing_game:
-                final_game_db_id = existing_game['id']
-            else:
-                # Safely get list names (They are already extracted as strings in search_game)
-                genres = json.dumps(match.get('genres', []))
-                themes = json.dumps(match.get('themes', []))
-                keywords = json.dumps(match.get('keywords', []))
-                developers = json.dumps(match.get('developers', []))
-                modes = json.dumps(match.get('game_modes', []))
-                
-                cover = match.get('cover', {}).get('url', '') if isinstance(match.get('cover'), dict) else ''
-                normalized = normalize_title(match['title'])
-                total_rating = match.get('total_rating')
-                total_rating_count = match.get('total_rating_count')
-                
-                c.execute('''
-                    INSERT INTO games (igdb_id, title, normalized_title, genres, themes, keywords, summary, cover_url, total_rating, total_rating_count, developers, game_modes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (igdb_id, match['title'], normalized, genres, themes, keywords, match.get('description', ''), cover, total_rating, total_rating_count, developers, modes))
-                final_game_db_id = c.lastrowid
-            
-            # Link library item to game
-            c.execute("UPDATE user_library SET game_id = ? WHERE id = ?", (final_game_db_id, lib_id))
-            conn.commit()
-            count += 1
-            print(f"Matched: {title} -> {match['title']}")
+        by_query[normalize_title(item['original_title'])].append(item)
+    for item in by_query.pop('', []):
+        print(f"No match for: {item['original_title']}")
+
+    # Skip titles that found nothing on earlier syncs until their backoff expires.
+    # Misses are keyed by normalized title, so a renamed entry is searched again right away.
+    now = time.time()
+    backing_off = set()
+    queries = list(by_query)
+    for chunk in chunks(queries):
+        placeholders = ','.join('?' * len(chunk))
+        rows = c.execute(f"SELECT normalized_title FROM igdb_misses WHERE normalized_title IN ({placeholders}) AND retry_after > ?", (*chunk, now))
+        backing_off.update(r[0] for r in rows)
+    if backing_off:
+        print(f"Skipping {len(backing_off)} titles IGDB had no match for on earlier syncs.")
+
+    to_search = [q for q in queries if q not in backing_off]
+    remaining = sum(len(by_query[q]) for q in to_search)
+    if progress:
+        progress(count, remaining)
+
+    def link_batch(conn, results):
+        c = conn.cursor()
+        linked = 0
+        for search_query, match in results.items():
+            for item in by_query[search_query]:
+                if link_library_item(c, item['id'], match):
+                    linked += 1
+                    print(f"Matched: {item['original_title']} -> {match['title']}")
+                else:
+                    print(f"No match for: {item['original_title']}")
+        record_title_misses(conn, [q for q, match in results.items() if not match])
+        conn.executemany("DELETE FROM igdb_misses WHERE normalized_title = ?", [(q,) for q, match in results.items() if match])
+        return linked
+
+    for batch, results in client.iter_search_games(to_search):
+        if results:
+            # One write per multiquery batch
+            count += write(link_batch, results)
         else:
-            print(f"No match for: {title}")
-            
-        time.sleep(0.25) # Throttle
-        
+            # Failed even after a retry: back off these titles like misses so progress still completes
+            print(f"IGDB search failed for {len(batch)} titles, will retry on a later sync.")
+            write(record_title_misses, batch)
+        remaining -= sum(len(by_query[q]) for q in batch)
+        if progress:
+            progress(count, remaining)
+        if should_stop and should_stop():
+            print("Enrichment stopped.")
+            break
+
     conn.close()
     print(f"Enrichment complete. Linked {count} games.")
 
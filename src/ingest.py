@@ -1,13 +1,14 @@
 import os
-import requests
 import json
+import time
 import asyncio
 import aiohttp
 import httpx
 from psnawp_api import PSNAWP
 from dotenv import load_dotenv
-from db import get_db_connection
-from datetime import timedelta
+import http_client
+from db import get_db_connection, write, chunks
+from datetime import datetime, timedelta, timezone
 
 # Xbox imports
 from xbox.webapi.api.client import XboxLiveClient
@@ -20,16 +21,163 @@ from legendary.core import LegendaryCore
 
 load_dotenv()
 
-def ingest_steam():
+# Records per executemany batch in write_library_records
+WRITE_BATCH = 1000
+
+# Xbox UserStats requests in flight at once
+XBOX_STATS_CONCURRENCY = 10
+
+# How an existing entry takes a reported playtime, per platform:
+# (minutes over which an 'unplayed' entry becomes 'played', whether a reported 0 keeps the stored playtime).
+# Steam and PSN always report the real playtime; GOG, Epic and Xbox report 0 when they don't know it.
+PLAYTIME_RULES = {
+    'steam': (10, False),
+    'psn': (10, False),
+}
+DEFAULT_PLAYTIME_RULE = (0, True)
+
+# Insert-or-update one platform entry. Blacklisted entries are skipped, new entries start 'played'
+# with over 10 minutes, and existing ones follow their platform's PLAYTIME_RULES.
+# Existing rows are only written when title, playtime, status or last played actually change,
+# so a sync that changes nothing writes nothing (and doesn't fire the library triggers).
+UPSERT_LIBRARY_SQL = '''
+    INSERT INTO user_library (platform, platform_id, original_title, playtime_minutes, manual_play_status, last_played)
+    SELECT :platform, :platform_id, :title, :playtime,
+           CASE WHEN :playtime > 10 THEN 'played' ELSE 'unplayed' END, :last_played
+    WHERE NOT EXISTS (SELECT 1 FROM blacklist b WHERE b.platform = :platform AND b.platform_id = :platform_id)
+    ON CONFLICT (platform, platform_id) DO UPDATE SET
+        original_title = excluded.original_title,
+        playtime_minutes = CASE
+            WHEN excluded.playtime_minutes > 0 OR NOT :keep_zero THEN excluded.playtime_minutes
+            ELSE playtime_minutes
+        END,
+        manual_play_status = CASE
+            WHEN manual_play_status = 'unplayed' AND excluded.playtime_minutes > :played_after THEN 'played'
+            ELSE manual_play_status
+        END,
+        last_played = COALESCE(excluded.last_played, last_played)
+    WHERE original_title IS NOT excluded.original_title
+       OR ((excluded.playtime_minutes > 0 OR NOT :keep_zero) AND playtime_minutes IS NOT excluded.playtime_minutes)
+       OR (manual_play_status = 'unplayed' AND excluded.playtime_minutes > :played_after)
+       OR (excluded.last_played IS NOT NULL AND last_played IS NOT excluded.last_played)
+'''
+# Platform Migration (xbox -> xbox_pc): entries first seen as 'xbox' move over
+# unless an 'xbox_pc' row for the title already exists
+MIGRATE_XBOX_SQL = '''
+    UPDATE user_library SET platform = 'xbox_pc'
+    WHERE platform = 'xbox' AND platform_id = ?
+      AND NOT EXISTS (SELECT 1 FROM user_library WHERE platform = 'xbox_pc' AND platform_id = ?)
+'''
+# How many of one platform's ids already have an entry (formatted with the id placeholders)
+COUNT_EXISTING_SQL = "SELECT COUNT(*) FROM user_library WHERE platform = ? AND platform_id IN ({placeholders})"
+
+def write_library_records(records):
+    """
+    Bulk-writes (platform, platform_id, title, playtime[, last_played]) records into user_library,
+    WRITE_BATCH rows per statement, in one write on the database writer thread.
+    Returns (new, changed, unchanged) counts; blacklisted records are not counted.
+    A key listed more than once counts once, with its last record written.
+    Ingesters take it as their `sink`, which sync.run_sync wraps to track progress.
+    """
+    return write(_write_library_records, list(records))
+
+def _write_library_records(conn, records):
+    totals = [0, 0, 0]
+    blacklist = {(r[0], r[1]) for r in conn.execute("SELECT platform, platform_id FROM blacklist")}
+    # One row per key, so a repeated key isn't counted as both new and changed
+    rows = {}
+    for record in records:
+        platform, platform_id, title, playtime = record[:4]
+        played_after, keep_zero = PLAYTIME_RULES.get(platform, DEFAULT_PLAYTIME_RULE)
+        rows[(platform, str(platform_id))] = {
+            'platform': platform,
+            'platform_id': str(platform_id),
+            'title': title,
+            'playtime': playtime or 0,
+            'last_played': record[4] if len(record) > 4 else None,
+            'played_after': played_after,
+            'keep_zero': int(keep_zero),
+        }
+    rows = list(rows.values())
+    for i in range(0, len(rows), WRITE_BATCH):
+        totals = [a + b for a, b in zip(totals, _write_batch(conn, rows[i:i + WRITE_BATCH], blacklist))]
+    return tuple(totals)
+
+def _write_batch(conn, batch, blacklist):
+    pc_ids = [(r['platform_id'], r['platform_id']) for r in batch if r['platform'] == 'xbox_pc']
+    if pc_ids:
+        migrated = conn.executemany(MIGRATE_XBOX_SQL, pc_ids).rowcount
+        if migrated:
+            print(f"Migrated {migrated} titles from 'xbox' to 'xbox_pc'")
+
+    # New entries are the batch's keys missing before the upsert, looked up on the unique index
+    keys = {(r['platform'], r['platform_id']) for r in batch} - blacklist
+    ids_by_platform = {}
+    for platform, platform_id in keys:
+        ids_by_platform.setdefault(platform, []).append(platform_id)
+    existing = 0
+    for platform, ids in ids_by_platform.items():
+        for chunk in chunks(ids):
+            placeholders = ','.join('?' * len(chunk))
+            existing += conn.execute(COUNT_EXISTING_SQL.format(placeholders=placeholders), [platform, *chunk]).fetchone()[0]
+    new = len(keys) - existing
+
+    # rowcount sums inserted and updated rows (trigger writes and skipped no-op updates are not counted)
+    written = conn.executemany(UPSERT_LIBRARY_SQL, batch).rowcount
+    considered = sum(1 for r in batch if (r['platform'], r['platform_id']) not in blacklist)
+    return new, written - new, considered - written
+
+# Incremental syncs only look at recent activity; everything is reconciled once a day
+FULL_SYNC_INTERVAL = 24 * 3600
+# Xbox history entries requested on an incremental sync (newest played first)
+XBOX_INCREMENTAL_ITEMS = 200
+
+def get_sync_state(platform):
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT * FROM sync_state WHERE platform = ?", (platform,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def needs_full_sync(state):
+    return not state or not state['last_full_sync'] or time.time() - state['last_full_sync'] >= FULL_SYNC_INTERVAL
+
+def mark_synced(platform, full, cursor=None):
+    """Records a successful sync. The cursor is kept when the platform didn't report a newer one."""
+    now = time.time()
+    write(lambda conn: conn.execute('''
+        INSERT INTO sync_state (platform, last_sync, last_full_sync, cursor) VALUES (?, ?, ?, ?)
+        ON CONFLICT (platform) DO UPDATE SET
+            last_sync = excluded.last_sync,
+            last_full_sync = COALESCE(excluded.last_full_sync, last_full_sync),
+            cursor = COALESCE(excluded.cursor, cursor)
+    ''', (platform, now, now if full else None, cursor)))
+
+def _as_utc(dt):
+    # Platform SDKs return aware datetimes, but don't trust it
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+def ingest_steam(sink=write_library_records, full=False, should_stop=None):
+    """Syncs the Steam library. Returns True once it's written, False if it failed or was stopped."""
     api_key = os.getenv("STEAM_API_KEY")
     steam_id = os.getenv("STEAM_ID")
     
     if not api_key or not steam_id:
         print("Skipping Steam: Missing credentials (STEAM_API_KEY or STEAM_ID).")
-        return
+        return False
 
-    print(f"Fetching Steam games for ID: {steam_id}...")
-    url = "http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/"
+    state = get_sync_state('steam')
+    full = full or needs_full_sync(state)
+
+    # Incremental syncs only ask for games played in the last two weeks;
+    # new purchases and everything else come in with the daily full sync
+    if full:
+        print(f"Fetching Steam games for ID: {steam_id}...")
+        url = "http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/"
+    else:
+        print(f"Fetching recently played Steam games for ID: {steam_id}...")
+        url = "http://api.steampowered.com/IPlayerService/GetRecentlyPlayedGames/v0001/"
     params = {
         'key': api_key,
         'steamid': steam_id,
@@ -39,57 +187,38 @@ def ingest_steam():
     }
 
     try:
-        resp = requests.get(url, params=params)
+        resp = http_client.get('steam', url, params=params)
         resp.raise_for_status()
         data = resp.json().get('response', {})
         games = data.get('games', [])
+        if should_stop and should_stop():
+            print("Steam sync stopped.")
+            return False
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        blacklist = { (r['platform'], r['platform_id']) for r in cursor.execute("SELECT platform, platform_id FROM blacklist").fetchall() }
-
-        count = 0
-        updated = 0
-        
-        for game in games:
-            title = game.get('name')
-            playtime = game.get('playtime_forever', 0)
-            appid = str(game.get('appid'))
-            
-            if ('steam', appid) in blacklist:
-                continue
-
-            cursor.execute('SELECT id, manual_play_status FROM user_library WHERE platform = ? AND platform_id = ?', ('steam', appid))
-            row = cursor.fetchone()
-            
-            if row:
-                if playtime > 10 and row['manual_play_status'] == 'unplayed':
-                    cursor.execute('UPDATE user_library SET playtime_minutes = ?, original_title = ?, last_played = CURRENT_TIMESTAMP, manual_play_status = ? WHERE id = ?',
-                                   (playtime, title, 'played', row['id']))
-                    updated += 1
-                else:
-                    cursor.execute('UPDATE user_library SET playtime_minutes = ?, original_title = ?, last_played = CURRENT_TIMESTAMP WHERE id = ?',
-                                   (playtime, title, row['id']))
-                    updated += 1
-            else:
-                initial_status = 'played' if playtime > 10 else 'unplayed'
-                cursor.execute('INSERT INTO user_library (platform, platform_id, original_title, playtime_minutes, manual_play_status) VALUES (?, ?, ?, ?, ?)',
-                               ('steam', appid, title, playtime, initial_status))
-                count += 1
-            
-        conn.commit()
-        conn.close()
-        print(f"Steam sync complete: {count} new, {updated} updated.")
+        # Steam reports when each game was last played (unix time, 0 = never; absent for recently played)
+        count, changed, unchanged = sink(
+            ('steam', game.get('appid'), game.get('name'), game.get('playtime_forever', 0),
+             time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(game['rtime_last_played'])) if game.get('rtime_last_played') else None)
+            for game in games
+        )
+        mark_synced('steam', full)
+        print(f"Steam {'full' if full else 'incremental'} sync complete: {count} new, {changed} changed, {unchanged} unchanged.")
+        return True
             
     except Exception as e:
         print(f"Error fetching Steam games: {e}")
+        return False
 
-def ingest_psn():
+def ingest_psn(sink=write_library_records, full=False, should_stop=None):
+    """Syncs the PSN library. Returns True once it's written, False if it failed or was stopped."""
     npsso = os.getenv("PSN_NPSSO")
     if not npsso:
         print("Skipping PSN: Missing NPSSO token.")
-        return
+        return False
+
+    state = get_sync_state('psn')
+    full = full or needs_full_sync(state) or not state['cursor']
+    since = None if full else datetime.fromisoformat(state['cursor'])
 
     try:
         print("Authenticating with PSN...")
@@ -97,52 +226,40 @@ def ingest_psn():
         client = psn.me()
         
         print("Fetching PSN titles...")
+        # Listed most recently played first and paged lazily, so an incremental sync
+        # stops requesting pages once it reaches titles last played before the cursor
         titles = client.title_stats()
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        blacklist = { (r['platform'], r['platform_id']) for r in cursor.execute("SELECT platform, platform_id FROM blacklist").fetchall() }
-
-        count = 0
-        updated = 0
-        
+        records = []
+        newest = None
         for title in titles:
-            game_name = title.name
-            title_id = title.title_id
-            
-            if ('psn', title_id) in blacklist:
-                continue
-            
+            # Checked per title, so a stop doesn't wait for the remaining pages
+            if should_stop and should_stop():
+                print("PSN sync stopped.")
+                return False
+            last_played = _as_utc(title.last_played_date_time) if getattr(title, 'last_played_date_time', None) else None
+            if since and last_played and last_played < since:
+                break
+            if last_played and (newest is None or last_played > newest):
+                newest = last_played
+
             playtime_minutes = 0
             if hasattr(title, 'play_duration') and title.play_duration:
                 playtime_minutes = int(title.play_duration.total_seconds() / 60)
+            records.append(('psn', title.title_id, title.name, playtime_minutes,
+                            last_played.strftime('%Y-%m-%d %H:%M:%S') if last_played else None))
 
-            cursor.execute('SELECT id, manual_play_status FROM user_library WHERE platform = ? AND platform_id = ?', ('psn', title_id))
-            row = cursor.fetchone()
-            
-            if row:
-                if playtime_minutes > 10 and row['manual_play_status'] == 'unplayed':
-                    cursor.execute('UPDATE user_library SET playtime_minutes = ?, original_title = ?, manual_play_status = ? WHERE id = ?', 
-                                   (playtime_minutes, game_name, 'played', row['id']))
-                else:
-                    cursor.execute('UPDATE user_library SET playtime_minutes = ?, original_title = ? WHERE id = ?', 
-                                   (playtime_minutes, game_name, row['id']))
-                updated += 1
-            else:
-                initial_status = 'played' if playtime_minutes > 10 else 'unplayed'
-                cursor.execute('INSERT INTO user_library (platform, platform_id, original_title, playtime_minutes, manual_play_status) VALUES (?, ?, ?, ?, ?)',
-                               ('psn', title_id, game_name, playtime_minutes, initial_status))
-                count += 1
-
-        conn.commit()
-        conn.close()
-        print(f"PSN sync complete: {count} new, {updated} updated.")
+        count, changed, unchanged = sink(records)
+        mark_synced('psn', full, newest.isoformat() if newest else None)
+        print(f"PSN {'full' if full else 'incremental'} sync complete: {count} new, {changed} changed, {unchanged} unchanged.")
+        return True
 
     except Exception as e:
         print(f"Error fetching PSN games: {e}")
+        return False
 
-def ingest_gog(token_or_data):
+def ingest_gog(token_or_data, sink=write_library_records, should_stop=None):
+    """Syncs the GOG library. Returns True once it's written, False if it failed or was stopped."""
     print("Fetching GOG games...")
     
     data_list = []
@@ -168,7 +285,7 @@ def ingest_gog(token_or_data):
                 print(f"Parsed {len(data_list)} separate JSON objects.")
             except Exception as e:
                 print(f"Error parsing GOG JSON: {e}")
-                return
+                return False
 
     # Mode 2: Network Fetch (Cookie or Bearer)
     else:
@@ -201,7 +318,7 @@ def ingest_gog(token_or_data):
         
         try:
             print(f"Requesting GOG with headers: {headers.keys()}")
-            resp = requests.get(url, headers=headers)
+            resp = http_client.get('gog', url, headers=headers)
             resp.raise_for_status()
             data_list = [resp.json()]
             
@@ -211,9 +328,9 @@ def ingest_gog(token_or_data):
             print(f"Error fetching GOG games: {e}")
             if hasattr(e, 'response') and e.response is not None:
                 print(f"Response status: {e.response.status_code}")
-            return
+            return False
             
-    if not data_list: return
+    if not data_list: return False
 
     # Normalize data structure from all payloads
     owned_ids = []
@@ -267,13 +384,16 @@ def ingest_gog(token_or_data):
         # Chunk ids to avoid URL too long
         chunk_size = 50
         for i in range(0, len(owned_ids), chunk_size):
+            if should_stop and should_stop():
+                print("GOG sync stopped.")
+                return False
             chunk = owned_ids[i:i+chunk_size]
             ids_str = ",".join(map(str, chunk))
             try:
                 # Generic UA for store API
                 s_headers = {"User-Agent": headers.get("User-Agent", "requests/python") if 'headers' in locals() else "requests/python"}
                 store_url = f"https://api.gog.com/products?ids={ids_str}"
-                s_resp = requests.get(store_url, headers=s_headers)
+                s_resp = http_client.get('gog', store_url, headers=s_headers)
                 s_resp.raise_for_status()
                 store_items = s_resp.json()
                 if isinstance(store_items, list):
@@ -282,13 +402,8 @@ def ingest_gog(token_or_data):
             except Exception as ex:
                 print(f"Failed to fetch metadata for chunk {i}: {ex}")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    count = 0
-    updated = 0
-    
-    for i, prod in enumerate(products):
+    records = []
+    for prod in products:
         # ID parser (handles diverse formats)
         game_id = str(prod.get('id') or prod.get('gameId') or prod.get('game_id') or ('None'))
         if game_id == 'None': continue
@@ -304,29 +419,19 @@ def ingest_gog(token_or_data):
         elif 'playTime' in prod:
              playtime = prod['playTime']
 
-        cursor.execute('SELECT id, manual_play_status FROM user_library WHERE platform = ? AND platform_id = ?', ('gog', game_id))
-        row = cursor.fetchone()
-        
-        if not row:
-            status = 'played' if playtime > 10 else 'unplayed'
-            cursor.execute('INSERT INTO user_library (platform, platform_id, original_title, playtime_minutes, manual_play_status) VALUES (?, ?, ?, ?, ?)',
-                           ('gog', game_id, title, playtime, status))
-            count += 1
-        else:
-             if playtime > 0:
-                 if row['manual_play_status'] == 'unplayed':
-                     cursor.execute('UPDATE user_library SET original_title = ?, playtime_minutes = ?, manual_play_status = ? WHERE id = ?', (title, playtime, 'played', row['id']))
-                 else:
-                     cursor.execute('UPDATE user_library SET original_title = ?, playtime_minutes = ? WHERE id = ?', (title, playtime, row['id']))
-             else:
-                 cursor.execute('UPDATE user_library SET original_title = ? WHERE id = ?', (title, row['id']))
-             updated += 1
-             
-    conn.commit()
-    conn.close()
-    print(f"GOG sync complete: {count} new, {updated} updated.")
+        records.append(('gog', game_id, title, playtime))
 
-def ingest_epic():
+    try:
+        count, changed, unchanged = sink(records)
+    except Exception as e:
+        print(f"Error writing GOG games: {e}")
+        return False
+    mark_synced('gog', True)
+    print(f"GOG sync complete: {count} new, {changed} changed, {unchanged} unchanged.")
+    return True
+
+def ingest_epic(sink=write_library_records, should_stop=None):
+    """Syncs the Epic library. Returns True once it's written, False if it failed or was stopped."""
     try:
         # config_path = os.path.expanduser("~/.config/legendary")
         
@@ -339,46 +444,30 @@ def ingest_epic():
         
         if not games:
              print("Skipping Epic: No games found or not logged in.")
-             return
+             return False
+        if should_stop and should_stop():
+            print("Epic sync stopped.")
+            return False
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        count = 0
-        updated = 0
-        
-        for game in games:
-            app_name = game.app_name 
-            title = game.app_title
-            
-            # Legendary returns play_time in minutes (if available from cloud saves/sync)
-            playtime = getattr(game, 'play_time', 0)
-            
-            cursor.execute('SELECT id, manual_play_status FROM user_library WHERE platform = ? AND platform_id = ?', ('epic', app_name))
-            row = cursor.fetchone()
-            
-            if not row:
-                status = 'played' if playtime > 10 else 'unplayed'
-                cursor.execute('INSERT INTO user_library (platform, platform_id, original_title, playtime_minutes, manual_play_status) VALUES (?, ?, ?, ?, ?)',
-                               ('epic', app_name, title, playtime, status))
-                count += 1
-            else:
-                # Update logic
-                if playtime > 0:
-                     if row['manual_play_status'] == 'unplayed':
-                         cursor.execute('UPDATE user_library SET original_title = ?, playtime_minutes = ?, manual_play_status = ? WHERE id = ?', (title, playtime, 'played', row['id']))
-                     else:
-                         cursor.execute('UPDATE user_library SET original_title = ?, playtime_minutes = ? WHERE id = ?', (title, playtime, row['id']))
-                updated += 1
-        
-        conn.commit()
-        conn.close()
-        print(f"Epic sync complete: {count} new, {updated} updated.")
+        # Legendary returns play_time in minutes (if available from cloud saves/sync)
+        count, changed, unchanged = sink(
+            ('epic', game.app_name, game.app_title, getattr(game, 'play_time', 0))
+            for game in games
+        )
+        # Legendary lists the whole library in one call, so Epic always syncs fully
+        mark_synced('epic', True)
+        print(f"Epic sync complete: {count} new, {changed} changed, {unchanged} unchanged.")
+        return True
         
     except Exception as e:
         print(f"Error fetching Epic games: {e}")
+        return False
+
+async def ingest_xbox_async(sink=write_library_records, full=False, should_stop=None):
+    """Syncs the Xbox library. Returns True once it's written, False if it failed or was stopped."""
+    def stopped():
+        return bool(should_stop and should_stop())
 
-async def ingest_xbox_async():
     token_path = "xbox_tokens.json"
     default_path = os.path.expanduser("~/.local/share/xbox/tokens.json")
     
@@ -388,7 +477,7 @@ async def ingest_xbox_async():
         token_path = default_path
     else:
         print(f"Skipping Xbox: tokens not found at {token_path} or {default_path}")
-        return
+        return False
 
     async with httpx.AsyncClient() as session:
         auth_mgr = AuthenticationManager(session, "", "", "")
@@ -414,26 +503,48 @@ async def ingest_xbox_async():
             if not xuid:
                  # If we can't find XUID, we can't fetch titles
                  print("Could not determine XUID from tokens.")
-                 return
+                 return False
+
+            state = get_sync_state('xbox')
+            full = full or needs_full_sync(state) or not state['cursor']
+            since = None if full else datetime.fromisoformat(state['cursor'])
+
+            def last_played(title):
+                history = getattr(title, 'title_history', None)
+                played = getattr(history, 'last_time_played', None) if history else None
+                return _as_utc(played) if played else None
 
             print(f"Fetching Xbox Title History for XUID {xuid}...")
             # For 2.x, titlehub is synchronous wrapper? No, it should be async.
-            # Increasing max_items to fetch full history (default is 5)
+            # History comes most recently played first: an incremental sync asks for the newest
+            # XBOX_INCREMENTAL_ITEMS, a full one raises max_items to fetch everything (default is 5)
             # Must explicitly request SERVICE_CONFIG_ID to use it for UserStats lookup
             title_history = await client.titlehub.get_title_history(
                 xuid,
                 fields=[TitleFields.STATS, TitleFields.SERVICE_CONFIG_ID],
-                max_items=5000
+                max_items=5000 if full else XBOX_INCREMENTAL_ITEMS
             )
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            count = 0
-            updated = 0
-            
-            for title in title_history.titles:
+            titles = title_history.titles or []
+            if stopped():
+                print("Xbox sync stopped.")
+                return False
+            if not full and len(titles) >= XBOX_INCREMENTAL_ITEMS and all((last_played(t) or since) >= since for t in titles):
+                # Everything in the page is newer than the cursor, so there may be more: reconcile fully
+                full, since = True, None
+                title_history = await client.titlehub.get_title_history(
+                    xuid,
+                    fields=[TitleFields.STATS, TitleFields.SERVICE_CONFIG_ID],
+                    max_items=5000
+                )
+                titles = title_history.titles or []
+            newest = max((p for p in map(last_played, titles) if p), default=None)
+
+            games = []
+            for title in titles:
                 # Type check might vary, ensure "Game"
                 if title.type != "Game": continue
+                # Incremental: only titles played since the last sync
+                if since and (last_played(title) or since) < since: continue
 
                 # Determine platform (Xbox Console vs Xbox PC)
                 # 'devices' list contains e.g. ['PC', 'Win32'] or ['XboxOne', 'XboxSeries']
@@ -444,28 +555,39 @@ async def ingest_xbox_async():
                 platform_code = 'xbox'
                 if is_pc and not is_console:
                     platform_code = 'xbox_pc'
-                
-                name = title.name
-                tid = title.title_id
-                scid = title.service_config_id
-                
-                # Check for stats
-                playtime = 0
-                
-                # Try fetching via UserStats if SCID is available
-                if scid:
+
+                games.append((platform_code, title))
+
+            # Fetch per-title stats concurrently (bounded) instead of one round trip at a time
+            semaphore = asyncio.Semaphore(XBOX_STATS_CONCURRENCY)
+
+            async def fetch_minutes_played(scid):
+                if not scid:
+                    return 0
+                async with semaphore:
+                    # Queued lookups are skipped once the sync is stopped
+                    if stopped():
+                        return 0
                     try:
                         # Fetch specific stats for this title
                         stats_resp = await client.userstats.get_stats(xuid, scid, stats_fields=["MinutesPlayed"])
                         if stats_resp.statlistscollection and stats_resp.statlistscollection[0].stats:
                              for stat in stats_resp.statlistscollection[0].stats:
                                  if stat.name == "MinutesPlayed":
-                                     playtime = int(stat.value)
-                                     break
+                                     return int(stat.value)
                     except Exception as e:
-                        # print(f"Failed to fetch stats for {name}: {e}")
+                        # print(f"Failed to fetch stats for {scid}: {e}")
                         pass
+                return 0
+
+            print(f"Fetching Xbox stats for {len(games)} titles...")
+            minutes = await asyncio.gather(*(fetch_minutes_played(title.service_config_id) for _, title in games))
+            if stopped():
+                print("Xbox sync stopped.")
+                return False
 
+            records = []
+            for (platform_code, title), playtime in zip(games, minutes):
                 # Fallback to TitleHub stats if available (legacy support)
                 if playtime == 0 and title.stats:
                     s = title.stats
@@ -474,43 +596,20 @@ async def ingest_xbox_async():
                     except:
                        pass
 
-                # Handle Platform Migration (xbox -> xbox_pc) if needed
-                if platform_code == 'xbox_pc':
-                     # Check if it exists as 'xbox' first and update it
-                     cursor.execute('SELECT id FROM user_library WHERE platform = ? AND platform_id = ?', ('xbox', tid))
-                     existing_xbox = cursor.fetchone()
-                     if existing_xbox:
-                         print(f"Migrating {name} from 'xbox' to 'xbox_pc'")
-                         cursor.execute('UPDATE user_library SET platform = ? WHERE id = ?', ('xbox_pc', existing_xbox['id']))
-
-                # Check existing (now migrated if applicable)
-                cursor.execute('SELECT id, manual_play_status FROM user_library WHERE platform = ? AND platform_id = ?', (platform_code, tid))
-                row = cursor.fetchone()
-                
-                if not row:
-                    status = 'played' if playtime > 10 else 'unplayed'
-                    cursor.execute('INSERT INTO user_library (platform, platform_id, original_title, playtime_minutes, manual_play_status) VALUES (?, ?, ?, ?, ?)',
-                                   (platform_code, tid, name, playtime, status))
-                    count += 1
-                else: 
-                     # Update
-                     if playtime > 0:
-                         if row['manual_play_status'] == 'unplayed':
-                             cursor.execute('UPDATE user_library SET original_title = ?, playtime_minutes = ?, manual_play_status = ? WHERE id = ?', (name, playtime, 'played', row['id']))
-                         else:
-                             cursor.execute('UPDATE user_library SET original_title = ?, playtime_minutes = ? WHERE id = ?', (name, playtime, row['id']))
-                     updated += 1
-            
-            conn.commit()
-            conn.close()
-            print(f"Xbox sync complete: {count} new, {updated} updated.")
+                records.append((platform_code, title.title_id, title.name, playtime))
+
+            count, changed, unchanged = sink(records)
+            mark_synced('xbox', full, newest.isoformat() if newest else None)
+            print(f"Xbox {'full' if full else 'incremental'} sync complete: {count} new, {changed} changed, {unchanged} unchanged.")
+            return True
             
         except Exception as e:
             print(f"Error fetching Xbox games: {e}")
+            return False
 
-def ingest_xbox():
+def ingest_xbox(sink=write_library_records, full=False, should_stop=None):
     # Helper to run async in sync context
-    asyncio.run(ingest_xbox_async())
+    return asyncio.run(ingest_xbox_async(sink, full, should_stop))
 
 if __name__ == "__main__":
     import db
@@ -0,0 +1,151 @@
+from db import get_db_connection
+from utils import fts_prefix_query
+
+# Library grid queries.
+# Without a search, pages are read from library_groups (see db._add_library_groups) by a range scan
+# on the sort's index from the keyset cursor. A search groups just the entries matching the FTS index.
+
+# Library rows per page of the infinite-scroll grid
+LIBRARY_PAGE_SIZE = 50
+
+# Library sort -> (library_groups column, direction). Keys never hold NULL so keyset paging works:
+# unrated and never-played games sort last through the 0 / '' defaults.
+# Ties are broken by the primary entry id in the same direction, so (key, id) follows one index.
+LIBRARY_SORTS = {
+    'playtime_desc': ('playtime_minutes', 'DESC'),
+    'playtime_asc': ('playtime_minutes', 'ASC'),
+    'title_asc': ('title_key', 'ASC'),
+    'rating_desc': ('rating', 'DESC'),
+    'last_played': ('last_played', 'DESC'),
+    'unmatched': ('playtime_minutes', 'DESC'),
+    'relevance': ('rank', 'ASC'), # bm25: lower is better, only with a search term
+}
+# bm25 weights of the library_search columns: original title, game title, normalized title, developers
+SEARCH_WEIGHTS = "10.0, 10.0, 5.0, 1.0"
+
+def library_sort(sort_by, search):
+    """Returns the sort to use: unknown sorts, and relevance without a search term, fall back to playtime_desc."""
+    if sort_by not in LIBRARY_SORTS or (sort_by == 'relevance' and not (search or '').strip()):
+        return 'playtime_desc'
+    return sort_by
+
+def library_query(search="", sort_by="playtime_desc", platform="all", cursor=None, limit=None):
+    """
+    Returns (sql, params) selecting one page of library groups plus one extra row (to tell if there's a next page),
+    or None when the search has nothing searchable in it.
+    """
+    limit = limit or LIBRARY_PAGE_SIZE
+    sort_by = library_sort(sort_by, search)
+    column, direction = LIBRARY_SORTS[sort_by]
+    params = []
+    where_conditions = []
+
+    match = fts_prefix_query(search)
+    if match:
+        # Search: every word as a prefix against the FTS index (see db._add_library_search),
+        # ranked with bm25 weighting titles over developers. Only the matches get grouped.
+        entry_conditions = []
+        params.append(match)
+        if platform and platform != 'all':
+            entry_conditions.append("ul.platform = ?")
+            params.append(platform)
+        if sort_by == 'unmatched':
+            entry_conditions.append("ul.game_id IS NULL")
+        entry_where = "WHERE " + " AND ".join(entry_conditions) if entry_conditions else ""
+        source = f"""
+            (
+                WITH entries AS (
+                    SELECT ul.id, ul.platform, ul.original_title, COALESCE(ul.last_played, '') AS last_played,
+                           COALESCE(ul.playtime_minutes, 0) AS playtime, COALESCE(ul.game_id, -ul.id) AS group_key, s.rank
+                    FROM (
+                        SELECT rowid, bm25(library_search, {SEARCH_WEIGHTS}) AS rank
+                        FROM library_search WHERE library_search MATCH ?
+                    ) s
+                    -- CROSS JOIN keeps the match as the outer loop, so the FTS query runs once
+                    CROSS JOIN user_library ul ON ul.id = s.rowid
+                    {entry_where}
+                ),
+                primaries AS (
+                    SELECT group_key, id, original_title,
+                           ROW_NUMBER() OVER (PARTITION BY group_key ORDER BY playtime DESC, id) AS n
+                    FROM entries
+                )
+                SELECT e.group_key, p.id AS primary_id,
+                       SUM(e.playtime) AS playtime_minutes,
+                       GROUP_CONCAT(DISTINCT e.platform) AS platforms,
+                       MAX(e.last_played) AS last_played,
+                       LOWER(p.original_title) AS title_key,
+                       COALESCE((SELECT rating FROM ratings WHERE game_id = e.group_key), 0) AS rating,
+                       MIN(e.rank) AS rank
+                FROM entries e
+                JOIN primaries p ON p.group_key = e.group_key AND p.n = 1
+                GROUP BY e.group_key
+            )
+        """
+        rank = "gr.rank"
+    elif search:
+        # Nothing searchable in the input (only punctuation)
+        return None
+    else:
+        source = "library_groups"
+        rank = "0"
+        where_conditions.append("gr.scope = ?")
+        params.append(platform if platform and platform != 'all' else 'all')
+        if sort_by == 'unmatched':
+            # Unmatched entries are their own group, keyed by -id (game ids are positive)
+            where_conditions.append("gr.group_key < 0")
+
+    if cursor:
+        # Rows strictly after the last one of the previous page, (key, primary id) being unique
+        op = '<' if direction == 'DESC' else '>'
+        where_conditions.append(f"(gr.{column}, gr.primary_id) {op} (?, ?)")
+        params.extend(cursor)
+
+    where = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+    sql = f"""
+        SELECT ul.id, ul.game_id, ul.platform, ul.platform_id, ul.original_title, ul.manual_play_status,
+               ul.achievements_unlocked, ul.achievements_total,
+               gr.playtime_minutes, gr.platforms, gr.last_played, {rank} AS rank,
+               g.cover_url, g.normalized_title, r.rating,
+               gr.{column} AS sort_key
+        FROM {source} gr
+        JOIN user_library ul ON ul.id = gr.primary_id
+        LEFT JOIN games g ON ul.game_id = g.id
+        LEFT JOIN ratings r ON r.game_id = ul.game_id
+        {where}
+        ORDER BY gr.{column} {direction}, gr.primary_id {direction}
+        LIMIT ?
+    """
+    return sql, params + [limit + 1]
+
+def fetch_games(search="", sort_by="playtime_desc", platform="all", cursor=None, limit=None):
+    """
+    Returns (games, next_cursor): one page of the library, with entries linked to the same game grouped
+    into one row (summed playtime, platform list, fields of the entry with the most playtime).
+    Pages are keyset-paginated on the active sort; pass the returned cursor to get the next one.
+    """
+    limit = limit or LIBRARY_PAGE_SIZE
+    query = library_query(search, sort_by, platform, cursor, limit)
+    if query is None:
+        return [], None
+
+    conn = get_db_connection()
+    rows = conn.execute(*query).fetchall()
+    conn.close()
+
+    games = []
+    for row in rows[:limit]:
+        game = dict(row)
+        game['platforms'] = game['platforms'].split(',')
+        games.append(game)
+
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = [games[-1]['sort_key'], games[-1]['id']]
+    return games, next_cursor
+
+def valid_cursor(cursor):
+    """True if a decoded cursor has the [sort key, entry id] shape fetch_games returns."""
+    return (isinstance(cursor, list) and len(cursor) == 2
+            and isinstance(cursor[0], (str, int, float)) and not isinstance(cursor[0], bool)
+            and isinstance(cursor[1], int) and not isinstance(cursor[1], bool))
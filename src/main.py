@@ -1,10 +1,10 @@
 import sys
 import os
 from tabulate import tabulate
-from db import get_db_connection, init_db
+from db import get_db_connection, write, init_db
 from ingest import ingest_steam, ingest_psn, ingest_xbox
 from igdb import sync_library_metadata
-from recommend import RecommenderEngine
+from recommend import get_engine
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -60,8 +60,7 @@ def manual_rate_games():
                 try:
                     score_int = int(score)
                     if 1 <= score_int <= 10:
-                        conn.execute("INSERT INTO ratings (game_id, rating) VALUES (?, ?)", (game['id'], score_int))
-                        conn.commit()
+                        write(lambda c: c.execute("INSERT INTO ratings (game_id, rating) VALUES (?, ?)", (game['id'], score_int)))
                         print("Saved.")
                     else:
                         print("Invalid score (1-10).")
@@ -74,28 +73,30 @@ def manual_rate_games():
     conn.close()
 
 def analyze_game():
-    engine = RecommenderEngine()
+    engine = get_engine()
     while True:
-        name = input("\nEnter game name to analyze (or 'q'): ")
+        name = input("\nEnter game name(s) to analyze, separated by ';' (or 'q'): ")
         if name.lower() == 'q': break
-        
+
+        titles = [t.strip() for t in name.split(';') if t.strip()]
         print("Analyzing...")
-        result = engine.analyze_game_compatibility(name)
-        
-        if "error" in result:
-            print(f"Error: {result['error']}")
-        else:
-            print(f"\nReport for: {result['title']}")
-            print(f"Prediction: {result['prediction']}")
-            print(f"Score: {result['compatibility_score']}/100")
+        results = engine.analyze_games(titles)
+
+        for title, result in zip(titles, results):
+            if not result:
+                print(f"\nError: '{title}' not found.")
+                continue
+            game = result['game']
+            print(f"\nReport for: {game.get('name') or game.get('title')}")
+            print(f"Prediction: {result['verdict']}")
+            print(f"Score: {result['score']}/100")
             print("Reasons:")
             for r in result['reasons']:
                 print(f" - {r}")
-            print(f"Summary: {result['summary']}")
         input("Press Enter...")
 
 def get_recs():
-    engine = RecommenderEngine()
+    engine = get_engine()
     print("Generating recommendations...")
     recs = engine.get_recommendations()
     
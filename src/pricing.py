@@ -1,54 +1,142 @@
-import requests
-import urllib.parse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import http_client
+from db import get_db_connection, write
+from utils import normalize_title
 
-def get_game_price(title):
+CHEAPSHARK_URL = "https://www.cheapshark.com/api/1.0/games"
+
+# Title -> CheapShark gameID matches barely change, deals do
+TITLE_TTL = 30 * 24 * 3600
+PRICE_TTL = 6 * 3600
+
+# Concurrent title searches (CheapShark is a free API, keep it polite)
+MAX_WORKERS = 4
+# CheapShark's multiple-games lookup accepts up to 25 ids
+IDS_PER_LOOKUP = 25
+
+def _prices_from_deals(deals):
+    prices = {}
+    # CheapShark Store IDs (Common ones)
+    # 1: Steam, 7: GOG, 8: Origin/EA, 11: Humble, 25: Epic Games Store
+    # PSN/Xbox/G2A are usually NOT in CheapShark public trusted API explicitly or require mapping.
+
+    # Filter for Steam
+    steam_deal = next((d for d in deals if d['storeID'] == '1'), None)
+    if steam_deal:
+        prices['Steam'] = steam_deal['price']
+
+    # Find the absolute cheapest and label it (could be GOG, GreenManGaming, etc - often better than Steam)
+    if deals:
+        best = min(deals, key=lambda x: float(x['price']))
+        prices['Best Deal'] = best['price']
+    return prices
+
+def _search_game_id(title):
+    """Returns the CheapShark gameID for a title, None if there is no match. Raises on network errors."""
+    resp = http_client.get('cheapshark', CHEAPSHARK_URL, params={'title': title, 'limit': 1}, timeout=2)
+    resp.raise_for_status()
+    data = resp.json()
+    return data[0].get('gameID') if data else None
+
+def _resolve_game_ids(conn, titles):
+    """
+    Maps normalized titles to CheapShark gameIDs, searching uncached titles concurrently.
+    titles is {normalized title: original title}; the cache is keyed by the normalized title,
+    but CheapShark is searched with the original one.
+    """
+    cutoff = time.time() - TITLE_TTL
+    resolved = {}
+    for norm in titles:
+        row = conn.execute("SELECT game_id, fetched_at FROM cheapshark_titles WHERE normalized_title = ?", (norm,)).fetchone()
+        if row and row['fetched_at'] >= cutoff:
+            resolved[norm] = row['game_id']
+
+    missing = [t for t in titles if t not in resolved]
+    if missing:
+        def search(norm):
+            try:
+                return norm, _search_game_id(titles[norm]), True
+            except Exception as e:
+                print(f"Pricing Error: {e}")
+                return norm, None, False
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            results = list(pool.map(search, missing))
+
+        now = time.time()
+        for norm, game_id, ok in results:
+            resolved[norm] = game_id
+        # Failed requests are not cached so they are retried next time
+        write(lambda c: c.executemany(
+            "INSERT OR REPLACE INTO cheapshark_titles (normalized_title, game_id, fetched_at) VALUES (?, ?, ?)",
+            [(norm, game_id, now) for norm, game_id, ok in results if ok]
+        ))
+    return resolved
+
+def _fetch_deals(conn, game_ids):
+    """Returns {gameID: prices} using the cache, with one multi-id lookup per 25 stale ids."""
+    cutoff = time.time() - PRICE_TTL
+    prices = {}
+    for gid in game_ids:
+        row = conn.execute("SELECT prices, fetched_at FROM cheapshark_prices WHERE game_id = ?", (gid,)).fetchone()
+        if row and row['fetched_at'] >= cutoff:
+            prices[gid] = json.loads(row['prices'])
+
+    stale = [g for g in game_ids if g not in prices]
+    batches = [stale[i:i + IDS_PER_LOOKUP] for i in range(0, len(stale), IDS_PER_LOOKUP)]
+
+    def lookup(batch):
+        try:
+            resp = http_client.get('cheapshark', CHEAPSHARK_URL, params={'ids': ','.join(batch)}, timeout=2)
+            resp.raise_for_status()
+            return batch, resp.json() or {}, True
+        except Exception as e:
+            print(f"Pricing Error: {e}")
+            return batch, {}, False
+
+    if batches:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            responses = list(pool.map(lookup, batches))
+
+        now = time.time()
+        fetched = {}
+        for batch, data, ok in responses:
+            if not ok: continue
+            # Ids CheapShark left out have no deals; cached as empty so they aren't asked for again until the TTL
+            for gid in batch:
+                info = data.get(gid) or {}
+                fetched[gid] = _prices_from_deals(info.get('deals', []))
+        # Failed lookups are not cached so they are retried next time
+        prices.update(fetched)
+        write(lambda c: c.executemany(
+            "INSERT OR REPLACE INTO cheapshark_prices (game_id, prices, fetched_at) VALUES (?, ?, ?)",
+            [(gid, json.dumps(p), now) for gid, p in fetched.items()]
+        ))
+    return prices
+
+def get_game_prices(titles):
+    """
+    Looks up prices for many titles at once.
+    Returns {title: {'Steam': ..., 'Best Deal': ...}} with None for titles without a match.
+    """
+    norms = {title: normalize_title(title) for title in titles}
+    conn = get_db_connection()
     try:
-        # Search CheapShark for the game
-        encoded_title = urllib.parse.quote(title)
-        search_url = f"https://www.cheapshark.com/api/1.0/games?title={encoded_title}&limit=1"
-        search_resp = requests.get(search_url, timeout=2)
-        
-        if search_resp.status_code == 200 and search_resp.json():
-            game_data = search_resp.json()[0]
-            game_id = game_data.get('gameID')
-            cheapest = game_data.get('cheapest')
-            
-            # Get detailed deal info to find stores
-            # Using deals endpoint to filtering specific stores could be complex, 
-            # for now let's just use the 'cheapest' price found as a generic "Deal"
-            # To get specific store prices (Steam vs others), we need the game lookup by ID.
-            
-            lookup_url = f"https://www.cheapshark.com/api/1.0/games?id={game_id}"
-            lookup_resp = requests.get(lookup_url, timeout=2)
-            
-            if lookup_resp.status_code == 200:
-                data = lookup_resp.json()
-                deals = data.get('deals', [])
-                
-                prices = {}
-                # CheapShark Store IDs (Common ones)
-                # 1: Steam, 7: GOG, 8: Origin/EA, 11: Humble, 25: Epic Games Store
-                # PSN/Xbox/G2A are usually NOT in CheapShark public trusted API explicitly or require mapping.
-                # User asked for Steam, PSN, G2A.
-                
-                # Filter for Steam
-                steam_deal = next((d for d in deals if d['storeID'] == '1'), None)
-                if steam_deal:
-                    prices['Steam'] = steam_deal['price']
-                    
-                # Find the absolute cheapest and label it (could be GOG, GreenManGaming, etc - often better than Steam)
-                # We can label this as "Best Deal"
-                if deals:
-                    best = min(deals, key=lambda x: float(x['price']))
-                    prices['Best Deal'] = best['price']
-                
-                # Mocking PSN/Keysites as they aren't in this free API easily
-                # In a real app we'd scrape or use a paid API for console/grey market
-                # For this demo, we can assume parity or indicate "Check Store"
-                
-                return prices
-                
-        return None
+        originals = {}
+        for title, norm in norms.items():
+            if norm:
+                originals.setdefault(norm, title)
+        game_ids = _resolve_game_ids(conn, originals)
+        prices = _fetch_deals(conn, list(dict.fromkeys(g for g in game_ids.values() if g)))
     except Exception as e:
         print(f"Pricing Error: {e}")
-        return None
+        return {title: None for title in titles}
+    finally:
+        conn.close()
+
+    return {title: prices.get(game_ids.get(norm)) for title, norm in norms.items()}
+
+def get_game_price(title):
+    return get_game_prices([title]).get(title)
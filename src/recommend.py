@@ -1,27 +1,104 @@
 import pandas as pd
 import json
+import os
+import glob
+import hashlib
+import joblib
 import numpy as np
-import requests
 import random
+import threading
+import time
 from collections import Counter
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from db import get_db_connection
+import http_client
+from db import DATA_DIR, thread_connection, write, get_data_versions, get_game_tags, chunks
 from igdb import IGDBClient
 from utils import normalize_title
-from pricing import get_game_price
+from pricing import get_game_prices
+from user_profile import load_profile
+
+# IGDB's similar_games lists barely change; refetch a source at most this often
+SIMILAR_GAMES_TTL = 30 * 24 * 3600
+
+# Candidate metadata (rating, summary, platforms) is refreshed from IGDB after this long
+CATALOG_TTL = 7 * 24 * 3600
+
+# Library platform filter -> IGDB platform ids (Steam = PC, PSN = PS4/PS5)
+PLATFORM_IGDB_IDS = {
+    'steam': (6,),
+    'psn': (48, 167),
+}
+
+CATALOG_FIELDS = "name, summary, rating, genres.name, cover.image_id, platforms"
+
+# Unplayed, unrated library games (entries of the same game grouped), the backlog candidates
+BACKLOG_QUERY = """
+    SELECT
+        GROUP_CONCAT(ul.id) as library_ids,
+        g.id as game_id,
+        g.title,
+        g.summary,
+        g.cover_url,
+        GROUP_CONCAT(DISTINCT ul.platform) as platforms,
+        MAX(COALESCE(ul.playtime_minutes, 0)) as playtime_minutes
+    FROM user_library ul
+    JOIN games g ON ul.game_id = g.id
+    WHERE (ul.playtime_minutes IS NULL OR ul.playtime_minutes < 120)
+      AND ul.manual_play_status = 'unplayed'
+      AND NOT EXISTS (
+          SELECT 1 FROM user_library ul2
+          WHERE ul2.game_id = g.id
+          AND (ul2.playtime_minutes >= 120 OR (ul2.manual_play_status != 'unplayed' AND ul2.manual_play_status IS NOT NULL))
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM ratings r WHERE r.game_id = g.id
+      )
+    GROUP BY g.id
+"""
+
+# Fitted TF-IDF models, one file per library fingerprint
+MODEL_DIR = os.path.join(DATA_DIR, 'models')
 
 class RecommenderEngine:
-    def __init__(self):
-        self.conn = get_db_connection()
-        self.igdb = IGDBClient()
-        self.igdb.authenticate()
+    def __init__(self, igdb=None, text_model=None):
+        """
+        igdb and text_model can be carried over from a previous engine (see get_engine), so a rebuild
+        doesn't re-authenticate or reload an unchanged model. text_model is (fingerprint, vectorizer, matrix).
+        """
+        if igdb is None:
+            igdb = IGDBClient()
+            igdb.authenticate()
+        self.igdb = igdb
+        self.text_model = text_model
         self.tfidf_vectorizer = None
         self.user_tfidf_matrix = None
-        self.train_text_model()
+        # The text model is loaded (or fitted) on first use, see _ensure_text_model
+        self._text_model_ready = False
+        self._user_matrix_t = None
+        self._text_model_lock = threading.Lock()
+
+    @property
+    def conn(self):
+        """Per-thread connection so one engine can be shared across request threads."""
+        return thread_connection()
+
+    def _ensure_text_model(self):
+        if self._text_model_ready: return
+        with self._text_model_lock:
+            if not self._text_model_ready:
+                self.train_text_model()
+                if self.user_tfidf_matrix is not None:
+                    # Transposed once so scoring is a single CSR x CSR product
+                    self._user_matrix_t = sparse.csr_matrix(self.user_tfidf_matrix.T)
+                self._text_model_ready = True
 
     def train_text_model(self):
-        """Builds a TF-IDF model based on summaries of games the user owns."""
+        """
+        Builds a TF-IDF model based on summaries of games the user owns.
+        Fitted models are cached on disk keyed by a fingerprint of the contributing summaries,
+        so new engines and worker processes only refit when that set changes.
+        """
         try:
             # Get summaries of games the user actually played/liked
             query = """
@@ -33,143 +110,100 @@ class RecommenderEngine:
                   AND g.summary != ''
                   AND (ul.playtime_minutes > 60 OR r.rating >= 7)
             """
-            df = pd.read_sql_query(query, self.conn)
-            
-            if not df.empty and len(df) > 5:
-                self.tfidf_vectorizer = TfidfVectorizer(stop_words='english')
-                self.user_tfidf_matrix = self.tfidf_vectorizer.fit_transform(df['summary'])
+            # Sorted so the fingerprint doesn't depend on row order
+            summaries = sorted(row[0] for row in self.conn.execute(query))
+            if len(summaries) <= 5: return
+
+            fingerprint = hashlib.sha1("\x00".join(summaries).encode('utf-8')).hexdigest()
+            path = os.path.join(MODEL_DIR, f"tfidf_{fingerprint}.joblib")
+
+            if self.text_model and self.text_model[0] == fingerprint:
+                # Same summaries as the engine this one replaced
+                _, self.tfidf_vectorizer, self.user_tfidf_matrix = self.text_model
+                return
+
+            if os.path.exists(path):
+                try:
+                    # Memory-map the matrix arrays instead of reading them into each process
+                    model = joblib.load(path, mmap_mode='r')
+                    self.tfidf_vectorizer = model['vectorizer']
+                    self.user_tfidf_matrix = model['matrix']
+                    self.text_model = (fingerprint, self.tfidf_vectorizer, self.user_tfidf_matrix)
+                    return
+                except Exception as e:
+                    print(f"Failed to load cached text model, refitting: {e}")
+
+            self.tfidf_vectorizer = TfidfVectorizer(stop_words='english')
+            # Rows come out L2-normalized (norm='l2'), so cosine similarity is a plain dot product
+            self.user_tfidf_matrix = self.tfidf_vectorizer.fit_transform(summaries)
+            self.text_model = (fingerprint, self.tfidf_vectorizer, self.user_tfidf_matrix)
+            self._save_text_model(path)
         except Exception as e:
             print(f"Failed to train text model: {e}")
 
+    def _save_text_model(self, path):
+        try:
+            os.makedirs(MODEL_DIR, exist_ok=True)
+            # Write then rename so concurrent workers never load a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            joblib.dump({'vectorizer': self.tfidf_vectorizer, 'matrix': self.user_tfidf_matrix}, tmp_path)
+            os.replace(tmp_path, path)
+
+            for old in glob.glob(os.path.join(MODEL_DIR, "tfidf_*.joblib")):
+                if old != path:
+                    try: os.remove(old)
+                    except OSError: pass
+        except Exception as e:
+            print(f"Failed to save text model: {e}")
+
     def score_text(self, text):
         """Scores an arbitrary text against the user's library using TF-IDF cosine similarity."""
-        if self.tfidf_vectorizer is None or self.user_tfidf_matrix is None or not text:
-            return 0.0
-            
+        return self.score_texts([text])[0]
+
+    def score_texts(self, texts, top_k=5, chunk_size=1000):
+        """
+        Batch version of score_text: one transform and one sparse product for all texts.
+        Returns a list of floats aligned with texts (0.0 for empty or non-string entries).
+        """
+        self._ensure_text_model()
+        scores = np.zeros(len(texts))
+        if self.tfidf_vectorizer is None or self._user_matrix_t is None:
+            return scores.tolist()
+
+        rows = [i for i, t in enumerate(texts) if t and isinstance(t, str)]
+        if not rows:
+            return scores.tolist()
+
         try:
-            # Transform text
-            text_vector = self.tfidf_vectorizer.transform([text])
-            
-            # Calculate similarity with all user games
-            similarities = cosine_similarity(text_vector, self.user_tfidf_matrix)
-            
-            # We take the mean of the top 3 matches (soft max)
-            # This represents "How close is this to my favorite types of games"
-            # simple max is also good. Let's do mean of top 5.
-            if similarities.size > 0:
-                top_scores = np.sort(similarities[0])[-5:]
-                return float(np.mean(top_scores))
-            return 0.0
+            k = min(top_k, self._user_matrix_t.shape[1])
+            # Chunked so the dense (texts x liked games) similarity block stays small
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                text_vectors = self.tfidf_vectorizer.transform([texts[i] for i in chunk])
+                # Both sides are L2-normalized, so the dot product is the cosine similarity
+                similarities = (text_vectors @ self._user_matrix_t).toarray()
+
+                # We take the mean of the top 5 matches (soft max)
+                # This represents "How close is this to my favorite types of games"
+                top_scores = np.partition(similarities, -k, axis=1)[:, -k:]
+                scores[chunk] = top_scores.mean(axis=1)
         except Exception as e:
             print(f"Error scoring text: {e}")
-            return 0.0
+            return np.zeros(len(texts)).tolist()
+        return scores.tolist()
 
     def is_ready(self):
+        self._ensure_text_model()
         return self.tfidf_vectorizer is not None
 
     def build_user_profile(self):
-        # Fetch user library with metadata AND ratings
-        # Removed "playtime > 60" constraint to capture "Rage Quits" (Low playtime + Low Rating)
-        query = '''
-            SELECT ul.playtime_minutes, g.genres, g.themes, g.keywords, g.title, g.developers, g.game_modes, r.rating
-            FROM user_library ul
-            JOIN games g ON ul.game_id = g.id
-            LEFT JOIN ratings r ON ul.game_id = r.game_id
-        '''
-        df = pd.read_sql_query(query, self.conn)
-        
-        # Fetch ignored games for negative profiling (Only those explicitly marked as 'not_interested')
-        ignored_query = '''
-            SELECT g.keywords
-            FROM ignored_recommendations ir
-            JOIN games g ON ir.igdb_id = g.igdb_id
-            WHERE ir.reason = 'not_interested'
-        '''
-        try:
-            ignored_df = pd.read_sql_query(ignored_query, self.conn)
-        except:
-             ignored_df = pd.DataFrame(columns=['keywords'])
-
-        if df.empty: return None
-            
-        total_playtime = df['playtime_minutes'].sum()
-        fav_game_row = df.loc[df['playtime_minutes'].idxmax()]
-        favorite_game = fav_game_row['title']
-
-        genre_scores = Counter()
-        theme_scores = Counter()
-        keyword_scores = Counter()
-        developer_scores = Counter() # New
-        game_mode_scores = Counter() # New
-        
-        disliked_genres = Counter()
-        disliked_themes = Counter()
-        disliked_keywords = Counter()
-        disliked_developers = Counter() # New
-        
-        for _, row in df.iterrows():
-            playtime = row['playtime_minutes']
-            rating = row['rating']
-            
-            # Filter Noise: Ignore short plays UNLESS they have a rating
-            if playtime < 60 and pd.isna(rating): continue
+        # Aggregates are persisted and updated incrementally (see user_profile.py)
+        # Short plays without a rating are skipped; "Rage Quits" (low playtime + low rating) count as dislikes
+        profile = load_profile(self.conn)
+        if not profile: return None
 
-            # Base weight from playtime (logarithmic)
-            base_weight = np.log1p(max(playtime, 10)) 
-            
-            is_disliked = False
-            if pd.notna(rating):
-                if rating >= 9: 
-                    # Massive boost for favorites regardless of playtime
-                    base_weight = max(base_weight, 15.0) * 2.5 
-                elif rating >= 8: 
-                    base_weight = max(base_weight, 10.0) * 1.5
-                elif rating >= 6: 
-                    base_weight *= 1.2 
-                elif rating <= 5: 
-                    base_weight = 0 
-                    is_disliked = True
-            
-            genres = [x.title() for x in (json.loads(row['genres']) if row['genres'] else [])]
-            themes = [x.title() for x in (json.loads(row['themes']) if row['themes'] else [])]
-            keywords = [x.lower() for x in (json.loads(row['keywords']) if row['keywords'] else [])]
-            
-            # Use safe parsing for new fields in case they are missing in older rows
-            developers = []
-            if 'developers' in row and row['developers']:
-                try: developers = json.loads(row['developers'])
-                except: pass
-                
-            modes = []
-            if 'game_modes' in row and row['game_modes']:
-                try: modes = json.loads(row['game_modes'])
-                except: pass
-
-            if is_disliked:
-                # Rage Quit Weight: Short playtime + Bad Rating = Stronger Dislike Signal
-                dislike_weight = 1
-                if playtime < 120: dislike_weight = 2 # "I hated this immediately"
-                
-                for g in genres: disliked_genres[g] += dislike_weight
-                for t in themes: disliked_themes[t] += dislike_weight
-                for k in keywords: disliked_keywords[k] += dislike_weight
-                for d in developers: disliked_developers[d] += dislike_weight
-                
-            # Only add to positive scores if NOT disliked (or add very small amount)
-            if not is_disliked:
-                for g in genres: genre_scores[g] += base_weight
-                for t in themes: theme_scores[t] += base_weight
-                for k in keywords: keyword_scores[k] += base_weight
-                
-                # New logic for devs and modes
-                for d in developers: developer_scores[d] += base_weight
-                for m in modes: game_mode_scores[m] += base_weight
-
-        negative_keywords = Counter()
-        if not ignored_df.empty:
-            for _, row in ignored_df.iterrows():
-                keywords = json.loads(row['keywords']) if row['keywords'] else []
-                for k in keywords: negative_keywords[k] += 1
+        genre_scores = profile['genres']
+        total_playtime = profile['total_minutes']
 
         # Determine Gamer Type
         gamer_type = "Novice Explorer"
@@ -193,17 +227,8 @@ class RecommenderEngine:
             else: prefix = "Aspiring"
             gamer_type = f"{prefix} {base_title}"
                 
-        return {
-            'genres': genre_scores, 'themes': theme_scores,
-            'keywords': keyword_scores, 'negative_keywords': negative_keywords, 
-            'disliked_genres': disliked_genres, 'disliked_themes': disliked_themes, 
-            'disliked_keywords': disliked_keywords,
-            'developers': developer_scores, 
-            'game_modes': game_mode_scores,
-            'disliked_developers': disliked_developers,
-            'total_minutes': total_playtime, 'favorite_game': favorite_game,
-            'gamer_type': gamer_type
-        }
+        profile['gamer_type'] = gamer_type
+        return profile
     
     def get_toxic_traits(self, profile):
         """Identify traits that are explicitly disliked AND not redeemed by positive history."""
@@ -266,37 +291,8 @@ class RecommenderEngine:
 
         # 2. Query Candidates (Unplayed Backlog)
         # Group duplicates directly in SQL
-        query = """
-            SELECT 
-                GROUP_CONCAT(ul.id) as library_ids, 
-                g.id as game_id, 
-                g.title, 
-                g.genres, 
-                g.themes, 
-                g.keywords, 
-                g.developers, 
-                g.game_modes, 
-                g.summary, 
-                g.cover_url, 
-                GROUP_CONCAT(DISTINCT ul.platform) as platforms, 
-                MAX(COALESCE(ul.playtime_minutes, 0)) as playtime_minutes
-            FROM user_library ul
-            JOIN games g ON ul.game_id = g.id
-            WHERE (ul.playtime_minutes IS NULL OR ul.playtime_minutes < 120)
-              AND ul.manual_play_status = 'unplayed'
-              AND NOT EXISTS (
-                  SELECT 1 FROM user_library ul2 
-                  WHERE ul2.game_id = g.id 
-                  AND (ul2.playtime_minutes >= 120 OR (ul2.manual_play_status != 'unplayed' AND ul2.manual_play_status IS NOT NULL))
-              )
-              AND NOT EXISTS (
-                  SELECT 1 FROM ratings r WHERE r.game_id = g.id
-              )
-            GROUP BY g.id
-        """
-        
         try:
-            candidates_df = pd.read_sql_query(query, self.conn)
+            candidates_df = pd.read_sql_query(BACKLOG_QUERY, self.conn)
         except Exception as e:
             print(f"Error querying backlog: {e}")
             return []
@@ -304,9 +300,6 @@ class RecommenderEngine:
         if candidates_df.empty:
             return []
 
-        scored_candidates = []
-        toxic_genres, toxic_keywords = self.get_toxic_traits(profile)
-
         # Weights
         W_GENRE = 1.0
         W_THEME = 0.8
@@ -322,7 +315,56 @@ class RecommenderEngine:
         P_DEV = 20.0
         P_NEG_KEYWORD = 10.0 
 
-        for _, row in candidates_df.iterrows():
+        # Per-kind tag weight: positive profile score minus disliked/ignored penalties
+        tag_weights = {
+            'genres': lambda g: profile['genres'].get(g, 0) * W_GENRE - profile['disliked_genres'].get(g, 0) * P_GENRE,
+            'themes': lambda t: profile['themes'].get(t, 0) * W_THEME - profile['disliked_themes'].get(t, 0) * P_THEME,
+            'keywords': lambda k: (profile['keywords'].get(k, 0) * W_KEYWORD
+                                   - profile['disliked_keywords'].get(k, 0) * P_KEYWORD
+                                   - profile['negative_keywords'].get(k, 0) * P_NEG_KEYWORD),
+            'developers': lambda d: profile['developers'].get(d, 0) * W_DEV - profile['disliked_developers'].get(d, 0) * P_DEV,
+            'game_modes': lambda m: profile['game_modes'].get(m, 0) * W_MODE,
+        }
+
+        # 3. Load tags into a sparse (candidate x tag) count matrix
+        game_tags = get_game_tags(self.conn, candidates_df['game_id'].tolist())
+        candidate_tags = []
+        for game_id in candidates_df['game_id']:
+            tags = game_tags[game_id]
+            candidate_tags.append({
+                'genres': [x.title() for x in tags['genres']],
+                'themes': [x.title() for x in tags['themes']],
+                'keywords': [x.lower() for x in tags['keywords']],
+                'developers': tags['developers'],
+                'game_modes': tags['game_modes'],
+            })
+
+        tag_index = {}
+        rows, cols = [], []
+        for n, tags in enumerate(candidate_tags):
+            for kind, values in tags.items():
+                for v in values:
+                    cols.append(tag_index.setdefault((kind, v), len(tag_index)))
+                    rows.append(n)
+
+        tag_matrix = sparse.csr_matrix(
+            (np.ones(len(cols)), (rows, cols)), shape=(len(candidate_tags), len(tag_index))
+        )
+        weight_vector = np.zeros(len(tag_index))
+        for (kind, v), col in tag_index.items():
+            weight_vector[col] = tag_weights[kind](v)
+
+        # 4. Score every candidate at once
+        scores = tag_matrix @ weight_vector
+
+        # Text Similarity
+        scores += np.asarray(self.score_texts(candidates_df['summary'].tolist())) * W_TEXT
+
+        # Sort by score descending (stable, so ties keep query order)
+        scored_candidates = []
+        for n in np.argsort(-scores, kind='stable')[:limit]:
+            row = candidates_df.iloc[n]
+
             # Parse aggregated fields
             lib_ids_str = str(row['library_ids']) if pd.notna(row['library_ids']) else ""
             platforms_str = str(row['platforms']) if pd.notna(row['platforms']) else ""
@@ -334,40 +376,6 @@ class RecommenderEngine:
             library_id = library_ids[0] if library_ids else None
             max_playtime = row['playtime_minutes'] if pd.notna(row['playtime_minutes']) else 0
 
-            # JSON Parsing and Normalization
-            try:
-                genres = [x.title() for x in (json.loads(row['genres']) if row['genres'] else [])]
-                themes = [x.title() for x in (json.loads(row['themes']) if row['themes'] else [])]
-                keywords = [x.lower() for x in (json.loads(row['keywords']) if row['keywords'] else [])]
-                developers = json.loads(row['developers']) if row['developers'] else []
-                modes = json.loads(row['game_modes']) if row['game_modes'] else []
-            except (json.JSONDecodeError, TypeError):
-                continue
-            
-            score = 0.0
-
-            # --- Scoring ---
-
-            # Positive Matches
-            for g in genres: score += profile['genres'].get(g, 0) * W_GENRE
-            for t in themes: score += profile['themes'].get(t, 0) * W_THEME
-            for k in keywords: score += profile['keywords'].get(k, 0) * W_KEYWORD
-            for d in developers: score += profile['developers'].get(d, 0) * W_DEV
-            for m in modes: score += profile['game_modes'].get(m, 0) * W_MODE
-            
-            # Negative Matches (Penalties)
-            for g in genres: score -= profile['disliked_genres'].get(g, 0) * P_GENRE
-            for t in themes: score -= profile['disliked_themes'].get(t, 0) * P_THEME
-            for k in keywords:
-                score -= profile['disliked_keywords'].get(k, 0) * P_KEYWORD
-                score -= profile['negative_keywords'].get(k, 0) * P_NEG_KEYWORD
-            for d in developers: score -= profile['disliked_developers'].get(d, 0) * P_DEV
-
-            # Text Similarity
-            if row['summary'] and isinstance(row['summary'], str):
-                txt_sim = self.score_text(row['summary'])
-                score += txt_sim * W_TEXT
-            
             scored_candidates.append({
                 'id': library_id,
                 'library_ids': library_ids,
@@ -375,28 +383,37 @@ class RecommenderEngine:
                 'cover_url': row['cover_url'],
                 'platforms': sorted(list(set(platforms))),
                 'playtime_minutes': max_playtime,
-                'score': score,
-                'genres': genres[:3]
+                'score': float(scores[n]),
+                'genres': candidate_tags[n]['genres'][:3]
             })
-            
-        # Sort by score descending
-        scored_candidates.sort(key=lambda x: x['score'], reverse=True)
         
-        return scored_candidates[:limit]
+        return scored_candidates
 
-    def get_recommendations(self, limit=12, genre_filter=None, platform_filter=None):
+    def get_recommendations(self, limit=12, genre_filter=None, platform_filter=None, include_prices=True):
         c = self.conn.cursor()
         
         # Base query for source games
         base_query = '''
-            SELECT DISTINCT g.igdb_id, g.title, ul.playtime_minutes, r.rating, g.genres
+            SELECT DISTINCT g.igdb_id, g.title, ul.playtime_minutes, r.rating, {genre_match} AS genre_match
             FROM user_library ul 
             JOIN games g ON ul.game_id = g.id 
             LEFT JOIN ratings r ON ul.game_id = r.game_id
             WHERE g.igdb_id IS NOT NULL 
         '''
         
+        # Indexed genre lookup via game_tags (tags.name is UNIQUE)
+        has_genre = genre_filter and genre_filter.lower() != 'all'
+        genre_exists = '''EXISTS (
+                SELECT 1 FROM game_tags gt JOIN tags t ON t.id = gt.tag_id
+                WHERE gt.game_id = g.id AND gt.tag_kind = 'genres' AND t.name = ?
+            )'''
         params = []
+        if has_genre:
+            base_query = base_query.format(genre_match=genre_exists)
+            params.append(genre_filter)
+        else:
+            base_query = base_query.format(genre_match='0')
+
         if platform_filter and platform_filter.lower() != 'all':
             base_query += " AND ul.platform = ?"
             params.append(platform_filter)
@@ -404,9 +421,8 @@ class RecommenderEngine:
         effective_source_games = []
         
         # 1. Targeted Source Selection
-        if genre_filter and genre_filter.lower() != 'all':
-            genre_sql = f"%{genre_filter}%"
-            c.execute(base_query + " AND g.genres LIKE ? ORDER BY ul.playtime_minutes DESC LIMIT 10", (*params, genre_sql))
+        if has_genre:
+            c.execute(base_query + " AND genre_match ORDER BY ul.playtime_minutes DESC LIMIT 10", tuple(params))
             effective_source_games.extend(c.fetchall())
             
         # 2. Fallback
@@ -425,6 +441,7 @@ class RecommenderEngine:
         
         active_source = effective_source_games[:10] 
         random.shuffle(active_source)
+        similar_map = self.get_similar_games([row['igdb_id'] for row in active_source])
 
         for row in active_source: 
             gid = row['igdb_id']
@@ -438,10 +455,10 @@ class RecommenderEngine:
                 if rating >= 8: weight *= 1.5
                 elif rating <= 5: weight *= 0.5 
             
-            if genre_filter and genre_filter.lower() != 'all' and row['genres'] and genre_filter in row['genres']:
+            if row['genre_match']:
                 weight *= 1.5
 
-            similars = self.fetch_similar_live(gid)
+            similars = similar_map.get(gid, [])
             for cand_id in similars:
                 candidate_weights[cand_id] += weight
                 if cand_id not in source_map: source_map[cand_id] = set()
@@ -481,11 +498,7 @@ class RecommenderEngine:
                     sources = list(source_map[rid])[:3]
                     res['based_on'] = ", ".join(sources)
                 
-                if len(results) < 9:
-                    price_info = get_game_price(res['name'])
-                    if price_info: res['prices'] = price_info
-                
-                results.append(res) # Corrected indentation here
+                results.append(res)
 
         # --- FALLBACK: Explicit Genre Discovery ---
         if len(results) < 5:
@@ -518,121 +531,272 @@ class RecommenderEngine:
                     if res['id'] in ignored_ids: continue
                     
                     res['based_on'] = f"Top Rated in {discovery_genre}"
-                    
-                    # Pricing check
-                    if len(results) < 9:
-                        price_info = get_game_price(res['name'])
-                        if price_info: res['prices'] = price_info
-                        
                     results.append(res)
+
+        # Pricing for the top results, looked up together (the web UI loads them lazily instead)
+        if include_prices and results:
+            prices = get_game_prices([r['name'] for r in results[:9]])
+            for res in results[:9]:
+                if prices.get(res['name']): res['prices'] = prices[res['name']]
                 
         return results
 
-    def fetch_similar_live(self, igdb_id):
-        if not igdb_id: return []
+    def get_similar_games(self, igdb_ids):
+        """
+        Returns {igdb_id: [similar igdb ids]} from the local similar_games graph.
+        Sources that are missing or older than SIMILAR_GAMES_TTL are refreshed from IGDB first.
+        """
+        igdb_ids = [i for i in dict.fromkeys(igdb_ids) if i]
+        if not igdb_ids: return {}
+
+        cutoff = time.time() - SIMILAR_GAMES_TTL
+        fresh = set()
+        for chunk in chunks(igdb_ids):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(f"""
+                SELECT source_igdb_id FROM similar_games_fetched
+                WHERE source_igdb_id IN ({placeholders}) AND fetched_at >= ?
+            """, (*chunk, cutoff))
+            fresh.update(r[0] for r in rows)
+
+        stale = [i for i in igdb_ids if i not in fresh]
+        if stale:
+            self.fetch_similar_batch(stale)
+
+        # Stale edges are still served if the refresh failed
+        result = {i: [] for i in igdb_ids}
+        for chunk in chunks(igdb_ids):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(f"""
+                SELECT source_igdb_id, similar_igdb_id FROM similar_games
+                WHERE source_igdb_id IN ({placeholders})
+                ORDER BY source_igdb_id, position
+            """, chunk)
+            for row in rows:
+                result[row[0]].append(row[1])
+        return result
+
+    def fetch_similar_batch(self, igdb_ids):
+        """Fetches similar_games for many sources in one IGDB query and stores the edges."""
         url = "https://api.igdb.com/v4/games"
         headers = { "Client-ID": self.igdb.client_id, "Authorization": f"Bearer {self.igdb.access_token}" }
-        body = f"fields similar_games; where id = {igdb_id};"
-        try:
-            r = requests.post(url, headers=headers, data=body)
-            if r.status_code == 200 and r.json():
-                return r.json()[0].get('similar_games', [])
-        except: pass
-        return []
+        # IGDB caps a single response at 500 rows
+        for i in range(0, len(igdb_ids), 500):
+            batch = igdb_ids[i:i + 500]
+            body = f"fields similar_games; where id = ({','.join(map(str, batch))}); limit {len(batch)};"
+            try:
+                r = http_client.post('igdb', url, headers=headers, data=body)
+                if r.status_code != 200: continue
+                data = r.json()
+            except Exception as e:
+                print(f"Similar games fetch error: {e}")
+                continue
+
+            similar = {g['id']: g.get('similar_games', []) for g in data if 'id' in g}
+            write(self._store_similar, batch, similar, time.time())
+
+    @staticmethod
+    def _store_similar(conn, batch, similar, now):
+        for source in batch:
+            # Unknown ids are recorded with no edges so they aren't re-requested every load
+            conn.execute("DELETE FROM similar_games WHERE source_igdb_id = ?", (source,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO similar_games (source_igdb_id, similar_igdb_id, position) VALUES (?, ?, ?)",
+                [(source, cand, pos) for pos, cand in enumerate(similar.get(source, []))]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO similar_games_fetched (source_igdb_id, fetched_at) VALUES (?, ?)",
+                (source, now)
+            )
 
     def fetch_genre_top_rated(self, genre_name, limit=10, platform_filter=None):
         url = "https://api.igdb.com/v4/games"
         headers = { "Client-ID": self.igdb.client_id, "Authorization": f"Bearer {self.igdb.access_token}" }
         
         where_clause = f'genres.name = "{genre_name}" & rating > 75 & rating_count > 10'
-        if platform_filter:
-            if platform_filter == 'steam': where_clause += " & platforms = (6)"
-            elif platform_filter == 'psn': where_clause += " & platforms = (48, 167)"
+        if platform_filter in PLATFORM_IGDB_IDS:
+            where_clause += f" & platforms = ({', '.join(map(str, PLATFORM_IGDB_IDS[platform_filter]))})"
             
-        body = f"fields name, summary, rating, genres.name, cover.image_id; where {where_clause}; sort rating desc; limit {limit};"
+        body = f"fields {CATALOG_FIELDS}; where {where_clause}; sort rating desc; limit {limit};"
         
         try:
-            r = requests.post(url, headers=headers, data=body)
-            if r.status_code == 200: return r.json()
+            r = http_client.post('igdb', url, headers=headers, data=body)
+            if r.status_code == 200:
+                games = r.json()
+                self.store_catalog(games)
+                return games
         except Exception as e:
             print(f"Discovery error: {e}")
         return []
 
-    def hydrate_candidates(self, igdb_ids, genre_filter=None, platform_filter=None):
-        if not igdb_ids: return []
-        ids_str = ",".join(map(str, igdb_ids))
+    def store_catalog(self, games, requested_ids=()):
+        """Upserts IGDB game payloads into igdb_catalog. Requested ids IGDB didn't return are stored empty."""
+        now = time.time()
+        rows = []
+        for g in games:
+            if 'id' not in g: continue
+            rows.append((
+                g['id'], g.get('name'), g.get('summary'), g.get('rating'),
+                json.dumps(g.get('genres', [])), (g.get('cover') or {}).get('image_id'),
+                json.dumps(g.get('platforms', [])), now
+            ))
+        returned = {r[0] for r in rows}
+        rows.extend((i, None, None, None, '[]', None, '[]', now) for i in requested_ids if i not in returned)
+        write(lambda conn: conn.executemany("""
+            INSERT OR REPLACE INTO igdb_catalog (igdb_id, name, summary, rating, genres, cover_image_id, platforms, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows))
+
+    def refresh_catalog(self, igdb_ids):
+        """Fetches catalog rows that are missing or older than CATALOG_TTL from IGDB."""
+        cutoff = time.time() - CATALOG_TTL
+        fresh = set()
+        for chunk in chunks(igdb_ids):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT igdb_id FROM igdb_catalog WHERE igdb_id IN ({placeholders}) AND fetched_at >= ?",
+                (*chunk, cutoff)
+            )
+            fresh.update(r[0] for r in rows)
+
+        stale = [i for i in igdb_ids if i not in fresh]
+        if not stale: return
+
         url = "https://api.igdb.com/v4/games"
         headers = { "Client-ID": self.igdb.client_id, "Authorization": f"Bearer {self.igdb.access_token}" }
-        
-        where_clause = f"id = ({ids_str})"
-        if genre_filter and genre_filter.lower() != 'all': where_clause += f' & genres.name = "{genre_filter}"'
-             
-        if platform_filter:
-            if platform_filter == 'steam': where_clause += " & platforms = (6)"
-            elif platform_filter == 'psn': where_clause += " & platforms = (48, 167)"
-
-        body = f"fields name, summary, rating, genres.name, cover.image_id; where {where_clause};"
-        try:
-            r = requests.post(url, headers=headers, data=body)
-            if r.status_code == 200: return r.json()
-        except: pass
-        return []
+        for i in range(0, len(stale), 500):
+            batch = stale[i:i + 500]
+            body = f"fields {CATALOG_FIELDS}; where id = ({','.join(map(str, batch))}); limit {len(batch)};"
+            try:
+                r = http_client.post('igdb', url, headers=headers, data=body)
+                if r.status_code == 200:
+                    self.store_catalog(r.json(), requested_ids=batch)
+            except Exception as e:
+                print(f"Catalog fetch error: {e}")
+
+    def hydrate_candidates(self, igdb_ids, genre_filter=None, platform_filter=None):
+        """
+        Returns IGDB-shaped dicts (id, name, summary, rating, genres, cover) for the candidates,
+        in the given order. Served from igdb_catalog; IGDB is only asked for missing/expired ids.
+        """
+        if not igdb_ids: return []
+        self.refresh_catalog(igdb_ids)
+
+        placeholders = ','.join('?' * len(igdb_ids))
+        query = f"SELECT * FROM igdb_catalog c WHERE c.igdb_id IN ({placeholders}) AND c.name IS NOT NULL"
+        params = list(igdb_ids)
+        if genre_filter and genre_filter.lower() != 'all':
+            query += " AND EXISTS (SELECT 1 FROM json_each(c.genres) WHERE json_extract(value, '$.name') = ?)"
+            params.append(genre_filter)
+        if platform_filter in PLATFORM_IGDB_IDS:
+            platform_ids = PLATFORM_IGDB_IDS[platform_filter]
+            query += f" AND EXISTS (SELECT 1 FROM json_each(c.platforms) WHERE value IN ({','.join('?' * len(platform_ids))}))"
+            params.extend(platform_ids)
+
+        rows = {row['igdb_id']: row for row in self.conn.execute(query, params)}
+
+        results = []
+        for igdb_id in igdb_ids:
+            row = rows.get(igdb_id)
+            if row is None: continue
+            # Mirror IGDB's payload, which omits empty fields
+            game = {'id': igdb_id, 'name': row['name']}
+            if row['summary']: game['summary'] = row['summary']
+            if row['rating'] is not None: game['rating'] = row['rating']
+            genres = json.loads(row['genres'] or '[]')
+            if genres: game['genres'] = genres
+            if row['cover_image_id']: game['cover'] = {'image_id': row['cover_image_id']}
+            results.append(game)
+        return results
 
     def analyze_game(self, title, igdb_id=None):
-        # 1. Search for the game
-        # Check local DB first for exact match or normalized match to save API calls/time
-        game = None
-
-        if igdb_id:
-             # If passed an ID, skip local lookup OR lookup by ID locally
-            c = self.conn.cursor()
-            c.execute("SELECT * FROM games WHERE igdb_id = ?", (igdb_id,))
-            local_game = c.fetchone()
-        else:
-            normalized_query = normalize_title(title)
-            
-            c = self.conn.cursor()
-            c.execute("SELECT * FROM games WHERE normalized_title = ? OR title = ?", (normalized_query, title))
-            local_game = c.fetchone()
-        
-        if local_game:
-            # Convert DB row to dict structure expected by analyzer
-            # Handle potential missing columns if DB wasn't fully migrated or old row
-            keys = local_game.keys()
-            
-            devs = []
-            if 'developers' in keys and local_game['developers']:
-                try: devs = json.loads(local_game['developers'])
-                except: pass
-                
-            modes = []
-            if 'game_modes' in keys and local_game['game_modes']:
-                try: modes = json.loads(local_game['game_modes'])
-                except: pass
-
-            game = {
-                'id': local_game['igdb_id'],
-                'name': local_game['title'],
-                'genres': [{'name': g} for g in json.loads(local_game['genres'] or '[]')],
-                'themes': [{'name': t} for t in json.loads(local_game['themes'] or '[]')],
-                'keywords': [{'name': k} for k in json.loads(local_game['keywords'] or '[]')],
-                'cover': {'url': local_game['cover_url']},
-                'total_rating': local_game['total_rating'] if 'total_rating' in keys else None,
-                'developers': devs,
-                'game_modes': modes
-            }
-        else:
-            if igdb_id:
-                game = self.igdb.get_game_by_id(igdb_id)
-            else:
-                game = self.igdb.search_game(title)
-            
-        if not game: return None
-            
+        return self.analyze_games([igdb_id if igdb_id else title])[0]
+
+    def analyze_games(self, queries):
+        """
+        Scores many games against a single profile build.
+        queries holds titles (str) and/or IGDB ids (int); results are aligned with it, None when not found.
+        """
+        # 1. Resolve games: local DB first, then batched IGDB lookups for the misses
+        games = self._find_local_games(queries)
+
+        missing_ids = list(dict.fromkeys(q for q in queries if isinstance(q, int) and q not in games))
+        missing_titles = list(dict.fromkeys(q for q in queries if isinstance(q, str) and q and q not in games))
+        games.update(self.igdb.get_games_by_ids(missing_ids))
+        games.update(self.igdb.search_games(missing_titles))
+
         # 2. Get User Profile
         profile = self.build_user_profile()
-        if not profile: return {'game': game, 'score': 0, 'verdict': 'Need Data', 'reasons': ['Not enough play history']}
-            
+
+        results = []
+        for q in queries:
+            game = games.get(q)
+            if not game:
+                results.append(None)
+            elif not profile:
+                results.append({'game': game, 'score': 0, 'verdict': 'Need Data', 'reasons': ['Not enough play history']})
+            else:
+                results.append(self._score_game(game, profile))
+        return results
+
+    def _find_local_games(self, queries):
+        """Looks up queried games in the local DB. Returns {query: game dict} in the analyzer's format."""
+        ids = [q for q in queries if isinstance(q, int)]
+        titles = [q for q in queries if isinstance(q, str) and q]
+        norms = {t: normalize_title(t) for t in titles}
+
+        rows = []
+        for start in range(0, max(len(ids), len(titles)), 300):
+            id_chunk = ids[start:start + 300]
+            title_chunk = titles[start:start + 300]
+            rows.extend(self.conn.execute(f'''
+                SELECT * FROM games
+                WHERE igdb_id IN ({','.join('?' * len(id_chunk))})
+                   OR normalized_title IN ({','.join('?' * len(title_chunk))})
+                   OR title IN ({','.join('?' * len(title_chunk))})
+                ORDER BY id
+            ''', id_chunk + [norms[t] for t in title_chunk] + title_chunk).fetchall())
+        if not rows:
+            return {}
+
+        by_igdb_id, by_norm, by_title = {}, {}, {}
+        for row in rows:
+            by_igdb_id.setdefault(row['igdb_id'], row)
+            by_norm.setdefault(row['normalized_title'], row)
+            by_title.setdefault(row['title'], row)
+
+        tags = get_game_tags(self.conn, [row['id'] for row in rows])
+        keys = rows[0].keys()
+
+        found = {}
+        for q in ids:
+            if q in by_igdb_id:
+                found[q] = by_igdb_id[q]
+        for t in titles:
+            # Same pick as "normalized_title = ? OR title = ?": the first matching row
+            matches = [r for r in (by_norm.get(norms[t]), by_title.get(t)) if r]
+            if matches:
+                found[t] = min(matches, key=lambda r: r['id'])
+
+        games = {}
+        for q, row in found.items():
+            # Convert DB row to dict structure expected by analyzer
+            game_tags = tags[row['id']]
+            games[q] = {
+                'id': row['igdb_id'],
+                'name': row['title'],
+                'genres': [{'name': g} for g in game_tags['genres']],
+                'themes': [{'name': t} for t in game_tags['themes']],
+                'keywords': [{'name': k} for k in game_tags['keywords']],
+                'cover': {'url': row['cover_url']},
+                'total_rating': row['total_rating'] if 'total_rating' in keys else None,
+                'developers': game_tags['developers'],
+                'game_modes': game_tags['game_modes']
+            }
+        return games
+
+    def _score_game(self, game, profile):
+        """Compatibility score, verdict and reasons for one game against a built profile."""
         # 3. Calculate Score
         score = 0
         reasons = []
@@ -953,3 +1117,26 @@ class RecommenderEngine:
             'verdict': verdict, 'color': color,
             'reasons': list(dict.fromkeys(reasons))[:5]
         }
+
+
+# --- Shared Engine ---
+# Keep one engine per process and only rebuild it when the library/ratings/ignore data changes.
+# A rebuild reuses the previous engine's IGDB client and text model; only the data-derived state is fresh.
+_engine = None
+_engine_versions = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Returns the process-wide RecommenderEngine, rebuilding it if the data moved."""
+    global _engine, _engine_versions
+    versions = get_data_versions()
+
+    with _engine_lock:
+        # None means the version table is missing; never trust a cached engine then
+        if _engine is None or versions is None or versions != _engine_versions:
+            if _engine is None:
+                _engine = RecommenderEngine()
+            else:
+                _engine = RecommenderEngine(igdb=_engine.igdb, text_model=_engine.text_model)
+            _engine_versions = versions
+        return _engine
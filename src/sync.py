@@ -0,0 +1,206 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from ingest import ingest_steam, ingest_psn, ingest_gog, ingest_epic, ingest_xbox, write_library_records
+from igdb import sync_library_metadata
+
+# Full library sync.
+# Platform fetches run concurrently (threads for the sync SDKs, Xbox on its own event loop in one of them),
+# their records go through the database writer thread (see db.write), and IGDB enrichment starts as soon as
+# the first platform's new rows land instead of after every platform has finished.
+# /api/sync runs it as a background SyncJob the UI polls for progress.
+
+# Finished jobs kept around for status polling
+MAX_FINISHED_JOBS = 10
+
+class SyncCancelled(Exception):
+    pass
+
+class SyncJob:
+    """One background run of run_sync, with the progress counters the UI polls."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = 'running' # 'running', 'done', 'cancelled', 'failed'
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        # platform -> {'status': 'fetching'|'done'|'failed'|'cancelled', 'fetched', 'new', 'changed', 'unchanged'}
+        # Replaced as a whole, never resized, so to_dict can iterate it from other threads
+        self.platforms = {}
+        self.enrichment = {'status': 'waiting', 'matched': 0, 'remaining': 0}
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'elapsed': round(end - self.started_at, 1),
+            'platforms': {name: dict(p) for name, p in self.platforms.items()},
+            'enrichment': dict(self.enrichment),
+        }
+
+def platform_jobs():
+    """
+    Ingesters configured on this machine, as {platform: fn(sink, should_stop=...)}.
+    Each returns True when its library was written and False when it failed or was stopped.
+    """
+    jobs = {}
+    if os.getenv("STEAM_API_KEY"):
+        jobs['steam'] = ingest_steam
+    if os.getenv("PSN_NPSSO"):
+        jobs['psn'] = ingest_psn
+
+    # Epic (Legendary)
+    if os.path.exists(os.path.expanduser("~/.config/legendary")):
+        jobs['epic'] = ingest_epic
+
+    # Xbox
+    if os.path.exists("xbox_tokens.json"):
+        jobs['xbox'] = ingest_xbox
+
+    # GOG
+    if os.path.exists("gog_token.txt"):
+        with open("gog_token.txt", "r") as f:
+            token = f.read().strip()
+        if token:
+            jobs['gog'] = lambda sink, should_stop=None: ingest_gog(token, sink=sink, should_stop=should_stop)
+    return jobs
+
+def run_sync(job=None):
+    """Fetches every configured platform concurrently and enriches new entries with IGDB metadata."""
+    job = job or SyncJob()
+    jobs = platform_jobs()
+    # Set when new rows land and once every fetch has finished
+    wake = threading.Event()
+    fetching_done = threading.Event()
+
+    job.platforms = {
+        name: {'status': 'fetching', 'fetched': 0, 'new': 0, 'changed': 0, 'unchanged': 0}
+        for name in jobs
+    }
+
+    def platform_sink(name):
+        progress = job.platforms[name]
+        def sink(records):
+            if job.cancelled:
+                raise SyncCancelled("Sync cancelled")
+            records = list(records)
+            counts = write_library_records(records)
+            if counts[0]:
+                wake.set()
+            progress['fetched'] += len(records)
+            for key, n in zip(('new', 'changed', 'unchanged'), counts):
+                progress[key] += n
+            return counts
+        return sink
+
+    def finished(name):
+        def done(future):
+            # Ingesters print and swallow their own errors, so their result says whether they finished
+            if not future.exception() and future.result():
+                status = 'done'
+            else:
+                status = 'cancelled' if job.cancelled else 'failed'
+            job.platforms[name]['status'] = status
+        return done
+
+    def enrich():
+        matched_before = 0
+        while True:
+            wake.wait()
+            done = fetching_done.is_set()
+            wake.clear()
+            if job.cancelled:
+                job.enrichment['status'] = 'cancelled'
+                return
+            job.enrichment['status'] = 'running'
+
+            def progress(matched, remaining):
+                job.enrichment['matched'] = matched_before + matched
+                job.enrichment['remaining'] = remaining
+            try:
+                sync_library_metadata(progress=progress, should_stop=lambda: job.cancelled)
+            except Exception as e:
+                print(f"Enrichment error: {e}")
+            matched_before = job.enrichment['matched']
+            if job.cancelled:
+                job.enrichment['status'] = 'cancelled'
+                return
+            # Rows that land during a pass are picked up by the next one
+            if done:
+                job.enrichment['status'] = 'done'
+                return
+            job.enrichment['status'] = 'waiting'
+
+    enricher = threading.Thread(target=enrich, name="igdb-enrichment")
+    enricher.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(jobs), 1), thread_name_prefix="ingest") as pool:
+            futures = {}
+            for name, fn in jobs.items():
+                futures[name] = pool.submit(fn, platform_sink(name), should_stop=lambda: job.cancelled)
+                futures[name].add_done_callback(finished(name))
+        for name, future in futures.items():
+            if future.exception():
+                print(f"Sync error ({name}): {future.exception()}")
+    finally:
+        fetching_done.set()
+        wake.set()
+        enricher.join()
+    return job
+
+# --- Background jobs ---
+
+_jobs = {}
+_current_job = None
+_jobs_lock = threading.Lock()
+
+def start_sync_job():
+    """Starts run_sync in the background, or returns the job that is already running."""
+    global _current_job
+    with _jobs_lock:
+        if _current_job and _current_job.status == 'running':
+            return _current_job
+        job = _current_job = SyncJob()
+        _jobs[job.id] = job
+        finished = [j for j in _jobs.values() if j.status != 'running']
+        for old in finished[:-MAX_FINISHED_JOBS]:
+            del _jobs[old.id]
+    threading.Thread(target=_run_job, args=(job,), name=f"sync-{job.id}", daemon=True).start()
+    return job
+
+def _run_job(job):
+    try:
+        run_sync(job)
+        failed = [name for name, p in job.platforms.items() if p['status'] == 'failed']
+        if job.cancelled:
+            job.status = 'cancelled'
+        elif failed and len(failed) == len(job.platforms):
+            job.status = 'failed'
+            job.error = f"No platform could be synced ({', '.join(failed)})"
+        else:
+            job.status = 'done'
+    except Exception as e:
+        print(f"Sync error: {e}")
+        job.status = 'failed'
+        job.error = str(e)
+    finally:
+        job.finished_at = time.time()
+
+def get_sync_job(job_id):
+    return _jobs.get(job_id)
+
+def current_sync_job():
+    return _current_job
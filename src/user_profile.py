@@ -0,0 +1,265 @@
+import math
+import threading
+from collections import Counter
+from db import get_game_tags, chunks, submit_write
+
+# Persisted taste profile.
+# profile_tags holds the aggregated Counters build_user_profile used to recompute from the whole
+# library, profile_games holds each game's current contribution so it can be retracted later.
+# Triggers (see db.init_db) queue changed games in profile_dirty; refresh_profile folds them in on the
+# writer thread, and load_profile folds the still-queued ones in memory meanwhile.
+
+# Positive kinds and how their tag names are normalized
+POSITIVE_KINDS = {
+    'genres': str.title,
+    'themes': str.title,
+    'keywords': str.lower,
+    'developers': None,
+    'game_modes': None,
+}
+# Tag kind -> profile key receiving dislike weight
+DISLIKED_KINDS = {
+    'genres': 'disliked_genres',
+    'themes': 'disliked_themes',
+    'keywords': 'disliked_keywords',
+    'developers': 'disliked_developers',
+}
+PROFILE_KEYS = list(POSITIVE_KINDS) + list(DISLIKED_KINDS.values()) + ['negative_keywords']
+
+def entry_weights(playtime, rating):
+    """
+    Returns (like_weight, dislike_weight) contributed by one library entry.
+    Short plays are ignored unless rated; ratings <= 5 turn the entry into a dislike.
+    """
+    # Filter Noise: Ignore short plays UNLESS they have a rating
+    if playtime < 60 and rating is None:
+        return 0.0, 0.0
+
+    # Base weight from playtime (logarithmic)
+    base_weight = math.log1p(max(playtime, 10))
+
+    if rating is not None:
+        if rating >= 9:
+            # Massive boost for favorites regardless of playtime
+            base_weight = max(base_weight, 15.0) * 2.5
+        elif rating >= 8:
+            base_weight = max(base_weight, 10.0) * 1.5
+        elif rating >= 6:
+            base_weight *= 1.2
+        elif rating <= 5:
+            # Rage Quit Weight: Short playtime + Bad Rating = Stronger Dislike Signal
+            return 0.0, (2.0 if playtime < 120 else 1.0)
+
+    return base_weight, 0.0
+
+def _tag_deltas(contributions, tags_by_game, sign, deltas=None):
+    """Adds (sign=1) or subtracts (sign=-1) game contributions into a {(kind, name): score} Counter."""
+    deltas = Counter() if deltas is None else deltas
+    for game_id, like, dislike, ignored in contributions:
+        tags = tags_by_game[game_id]
+        for kind, norm in POSITIVE_KINDS.items():
+            for name in tags[kind]:
+                key = norm(name) if norm else name
+                if like:
+                    deltas[(kind, key)] += like * sign
+                if dislike and kind in DISLIKED_KINDS:
+                    deltas[(DISLIKED_KINDS[kind], key)] += dislike * sign
+        if ignored:
+            for name in tags['keywords']:
+                deltas[('negative_keywords', name)] += sign
+    return deltas
+
+def _apply(conn, contributions, tags_by_game, sign):
+    """Adds (sign=1) or retracts (sign=-1) stored game contributions into profile_tags."""
+    deltas = _tag_deltas(contributions, tags_by_game, sign)
+    if not deltas:
+        return
+    conn.executemany('''
+        INSERT INTO profile_tags (kind, name, score) VALUES (?, ?, ?)
+        ON CONFLICT(kind, name) DO UPDATE SET score = score + excluded.score
+    ''', [(k, n, v) for (k, n), v in deltas.items()])
+    # Every contribution is positive, so a (near) zero score means the tag left the profile
+    conn.executemany(
+        "DELETE FROM profile_tags WHERE kind = ? AND name = ? AND ABS(score) < 1e-9",
+        list(deltas)
+    )
+
+def _stored_contributions(conn, game_ids):
+    rows = []
+    for chunk in chunks(game_ids):
+        placeholders = ','.join('?' * len(chunk))
+        rows.extend(conn.execute(f'''
+            SELECT game_id, like_weight, dislike_weight, ignored, total_minutes
+            FROM profile_games WHERE game_id IN ({placeholders})
+        ''', chunk).fetchall())
+    return rows
+
+def _compute_contributions(conn, game_ids):
+    """Recomputes profile_games rows for the given games from library, ratings and ignores."""
+    entries = {gid: [] for gid in game_ids}
+    ratings = {}
+    ignored = set()
+    for chunk in chunks(game_ids):
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f"SELECT game_id, COALESCE(playtime_minutes, 0) FROM user_library WHERE game_id IN ({placeholders})", chunk):
+            entries[row[0]].append(row[1])
+        for row in conn.execute(f"SELECT game_id, rating FROM ratings WHERE game_id IN ({placeholders})", chunk):
+            ratings[row[0]] = row[1]
+        for row in conn.execute(f'''
+            SELECT g.id FROM games g
+            JOIN ignored_recommendations ir ON ir.igdb_id = g.igdb_id
+            WHERE ir.reason = 'not_interested' AND g.id IN ({placeholders})
+        ''', chunk):
+            ignored.add(row[0])
+
+    result = []
+    for gid in game_ids:
+        like = dislike = 0.0
+        for playtime in entries[gid]:
+            l, d = entry_weights(playtime, ratings.get(gid))
+            like += l
+            dislike += d
+        if entries[gid] or gid in ignored:
+            result.append((gid, like, dislike, int(gid in ignored), sum(entries[gid]),
+                           max(entries[gid], default=0), len(entries[gid])))
+    return result
+
+def _update_games(conn, game_ids):
+    tags_by_game = get_game_tags(conn, game_ids)
+
+    old = _stored_contributions(conn, game_ids)
+    _apply(conn, [r[:4] for r in old], tags_by_game, -1)
+    old_minutes = sum(r[4] for r in old)
+
+    new = _compute_contributions(conn, game_ids)
+    for chunk in chunks(game_ids):
+        placeholders = ','.join('?' * len(chunk))
+        conn.execute(f"DELETE FROM profile_games WHERE game_id IN ({placeholders})", chunk)
+    conn.executemany('''
+        INSERT INTO profile_games (game_id, like_weight, dislike_weight, ignored, total_minutes, max_playtime, entries)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', new)
+    _apply(conn, [r[:4] for r in new], tags_by_game, 1)
+
+    conn.execute(
+        "UPDATE profile_meta SET value = value + ? WHERE key = 'total_minutes'",
+        (sum(r[4] for r in new) - old_minutes,)
+    )
+
+# Pending background fold of profile_dirty, so reads queue at most one
+_fold_future = None
+_fold_lock = threading.Lock()
+
+def refresh_profile():
+    """Queues the fold of profile_dirty into the persisted profile on the writer thread. Doesn't wait for it."""
+    global _fold_future
+    with _fold_lock:
+        if _fold_future is None or _fold_future.done():
+            _fold_future = submit_write(_fold_dirty)
+        return _fold_future
+
+def _fold_dirty(conn):
+    # Runs on the writer thread, so the queue can't be applied twice by concurrent readers
+    if not conn.execute("SELECT 1 FROM profile_meta WHERE key = 'total_minutes'").fetchone():
+        conn.execute("DELETE FROM profile_tags")
+        conn.execute("DELETE FROM profile_games")
+        conn.execute("INSERT OR REPLACE INTO profile_meta (key, value) VALUES ('total_minutes', 0)")
+        conn.execute('''
+            INSERT OR IGNORE INTO profile_dirty (game_id)
+            SELECT game_id FROM user_library WHERE game_id IS NOT NULL
+            UNION
+            SELECT g.id FROM games g JOIN ignored_recommendations ir ON ir.igdb_id = g.igdb_id
+        ''')
+
+    dirty = [r[0] for r in conn.execute("SELECT game_id FROM profile_dirty")]
+    for chunk in chunks(dirty):
+        _update_games(conn, chunk)
+    conn.execute("DELETE FROM profile_dirty")
+
+def retract_game(conn, game_id):
+    """
+    Removes a game's contribution before its tags change and queues it for re-adding.
+    Called by db.set_game_tags inside the caller's transaction.
+    """
+    old = _stored_contributions(conn, [game_id])
+    if not old:
+        return
+    _apply(conn, [r[:4] for r in old], get_game_tags(conn, [game_id]), -1)
+    conn.execute("UPDATE profile_meta SET value = value - ? WHERE key = 'total_minutes'", (old[0][4],))
+    conn.execute("DELETE FROM profile_games WHERE game_id = ?", (game_id,))
+    conn.execute("INSERT OR IGNORE INTO profile_dirty (game_id) VALUES (?)", (game_id,))
+
+def load_profile(conn):
+    """
+    Returns the profile as Counters plus play totals, or None if no game is linked.
+    Reads the persisted profile and folds games still queued in profile_dirty in memory, so it never
+    waits on the writer (e.g. behind a running sync); the durable fold is queued with refresh_profile.
+    Cost is proportional to the profile size plus the queued games, not the library size.
+    """
+    # One read transaction, so a fold committing meanwhile can't be seen half-way
+    if conn.in_transaction:
+        return _read_profile(conn)
+    conn.execute("BEGIN")
+    try:
+        return _read_profile(conn)
+    finally:
+        conn.commit()
+
+def _read_profile(conn):
+    built = conn.execute("SELECT value FROM profile_meta WHERE key = 'total_minutes'").fetchone()
+    if built:
+        dirty = [r[0] for r in conn.execute("SELECT game_id FROM profile_dirty")]
+    else:
+        # Never built: everything counts as queued
+        dirty = [r[0] for r in conn.execute('''
+            SELECT game_id FROM user_library WHERE game_id IS NOT NULL
+            UNION
+            SELECT g.id FROM games g JOIN ignored_recommendations ir ON ir.igdb_id = g.igdb_id
+        ''')]
+    if dirty:
+        refresh_profile()
+
+    profile = {key: Counter() for key in PROFILE_KEYS}
+    total_minutes = 0
+    fav = None
+    if built:
+        for row in conn.execute("SELECT kind, name, score FROM profile_tags"):
+            if row[0] in profile:
+                profile[row[0]][row[1]] = row[2]
+        total_minutes = built[0]
+        # Stored rows of queued games are about to be replaced, skip them
+        skip = set(dirty)
+        for row in conn.execute('''
+            SELECT pg.game_id, pg.max_playtime, g.title FROM profile_games pg
+            JOIN games g ON g.id = pg.game_id
+            WHERE pg.entries > 0
+            ORDER BY pg.max_playtime DESC
+            LIMIT ?
+        ''', (len(skip) + 1,)):
+            if row[0] not in skip:
+                fav = (row[1], row[2])
+                break
+
+    if dirty:
+        tags_by_game = get_game_tags(conn, dirty)
+        old = _stored_contributions(conn, dirty) if built else []
+        new = _compute_contributions(conn, dirty)
+        deltas = _tag_deltas([r[:4] for r in old], tags_by_game, -1)
+        _tag_deltas([r[:4] for r in new], tags_by_game, 1, deltas)
+        for (kind, name), delta in deltas.items():
+            counter = profile[kind]
+            counter[name] += delta
+            if abs(counter[name]) < 1e-9:
+                del counter[name]
+        total_minutes += sum(r[4] for r in new) - sum(r[4] for r in old)
+
+        top = max((r for r in new if r[6] > 0), key=lambda r: r[5], default=None)
+        if top and (fav is None or top[5] > fav[0]):
+            title = conn.execute("SELECT title FROM games WHERE id = ?", (top[0],)).fetchone()
+            fav = (top[5], title[0])
+
+    if not fav:
+        return None
+    profile['total_minutes'] = total_minutes
+    profile['favorite_game'] = fav[1]
+    return profile
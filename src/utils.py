@@ -27,3 +27,11 @@ def normalize_title(title: str) -> str:
     t = re.sub(r'\s+', ' ', t).strip()
     
     return t
+
+def fts_prefix_query(text: str) -> str:
+    """
+    Turns search box input into an FTS5 query that matches every word as a prefix,
+    e.g. 'elden ri' -> '"elden"* "ri"*'. Returns '' when there is no word to search for.
+    """
+    words = re.findall(r'\w+', (text or '').lower())
+    return ' '.join(f'"{w}"*' for w in words)
@@ -1,144 +1,73 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, url_for
 import sqlite3
 import os
 import json
-import requests
 from collections import defaultdict
-from db import get_db_connection
-from igdb import IGDBClient, normalize_title
-from ingest import ingest_steam, ingest_psn, ingest_gog, ingest_epic, ingest_xbox
-from recommend import RecommenderEngine
+import http_client
+from db import get_db_connection, release_thread_connection, write, init_db, set_game_tags
+from igdb import IGDBClient, normalize_title, clear_title_misses
+from library import fetch_games, library_sort, valid_cursor
+from sync import start_sync_job, get_sync_job, current_sync_job
+from recommend import get_engine
 from epic import get_free_games
+from pricing import get_game_price
 
 app = Flask(__name__)
 
-# Helper to get games with filters
-def fetch_games(search="", sort_by="playtime_desc", platform="all"):
-    conn = get_db_connection()
-    # Base Query: Join library with games and ratings (if any)
-    query = """
-        SELECT ul.*, g.cover_url, g.normalized_title, 
-               r.rating, 
-               COALESCE(ul.playtime_minutes, 0) as playtime_minutes
-        FROM user_library ul
-        LEFT JOIN games g ON ul.game_id = g.id
-        LEFT JOIN ratings r ON g.id = r.game_id
-    """
-    params = []
-    where_conditions = []
-    
-    # Filter
-    if search:
-        where_conditions.append("(ul.original_title LIKE ? OR g.title LIKE ?)")
-        params.extend([f"%{search}%", f"%{search}%"])
-    
-    if platform and platform != 'all':
-        where_conditions.append("ul.platform = ?")
-        params.append(platform)
-        
-    if sort_by == 'unmatched':
-        where_conditions.append("ul.game_id IS NULL")
-        
-    if where_conditions:
-        query += " WHERE " + " AND ".join(where_conditions)
-        
-    # Sort
-    if sort_by == 'playtime_desc' or sort_by == 'unmatched':
-        query += " ORDER BY playtime_minutes DESC"
-    elif sort_by == 'playtime_asc':
-        query += " ORDER BY playtime_minutes ASC"
-    elif sort_by == 'title_asc':
-        query += " ORDER BY ul.original_title ASC"
-    elif sort_by == 'rating_desc':
-        query += " ORDER BY r.rating DESC NULLS LAST"
-    elif sort_by == 'last_played':
-        query += " ORDER BY ul.last_played DESC NULLS LAST"
-    else:
-        query += " ORDER BY playtime_minutes DESC"
-
-    # Execute
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
-
-    # Post-process to group by game_id
-    grouped_games = {}
-    unmatched_games = []
+def render_library(template, search="", sort="playtime_desc", platform="all", cursor=None, **context):
+    """Renders a library template with one page of games and the URL of the next page (None on the last)."""
+    games, next_cursor = fetch_games(search, sort, platform, cursor)
+    next_page_url = None
+    if next_cursor:
+        next_page_url = url_for('library_grid', search=search, sort=sort, platform=platform, cursor=json.dumps(next_cursor, separators=(',', ':')))
+    return render_template(template, games=games, next_page_url=next_page_url,
+                           first_page=cursor is None, **context)
 
-    for row in rows:
-        game = dict(row)
-        game['playtime_minutes'] = game['playtime_minutes'] or 0
-        
-        # If matched to a golden record, group it
-        if game.get('game_id'):
-            gid = game['game_id']
-            if gid in grouped_games:
-                existing = grouped_games[gid]
-                existing['playtime_minutes'] += game['playtime_minutes']
-                if game['platform'] not in existing['platforms']:
-                    existing['platforms'].append(game['platform'])
-                # Keep the entry with the most playtime as the "primary" one for display/editing
-                if game['playtime_minutes'] > (existing.get('max_playtime_entry') or 0):
-                     existing['max_playtime_entry'] = game['playtime_minutes']
-                     # Update fields that should reflect the main platform used
-                     existing['manual_play_status'] = game['manual_play_status']
-                     existing['id'] = game['id'] # Points to user_library.id of main entry
-            else:
-                game['platforms'] = [game['platform']]
-                game['max_playtime_entry'] = game['playtime_minutes']
-                grouped_games[gid] = game
-        else:
-            game['platforms'] = [game['platform']]
-            unmatched_games.append(game)
-
-    # Combine
-    final_list = list(grouped_games.values()) + unmatched_games
-
-    # Python-side Sorting
-    if sort_by == 'playtime_asc':
-        final_list.sort(key=lambda x: x['playtime_minutes'])
-    elif sort_by == 'title_asc':
-        final_list.sort(key=lambda x: (x.get('original_title') or x.get('normalized_title') or "").lower())
-    elif sort_by == 'last_played':
-         final_list.sort(key=lambda x: (x.get('last_played') or ""), reverse=True)
-    elif sort_by == 'rating_desc':
-         final_list.sort(key=lambda x: (x.get('rating') or 0), reverse=True)
-    else: # playtime_desc or default
-         final_list.sort(key=lambda x: x['playtime_minutes'], reverse=True)
-
-    return final_list
+@app.teardown_request
+def release_db_connection(exc):
+    # Hand the request thread's connection back to the pool
+    release_thread_connection()
 
 @app.route("/")
 def index():
     # Capture query params to support bookmarking/refreshing filters
     search = request.args.get("search", "")
-    sort = request.args.get("sort", "playtime_desc")
+    sort = library_sort(request.args.get("sort", "playtime_desc"), search)
     platform = request.args.get("platform", "all")
     
-    games = fetch_games(search, sort, platform)
-    
     # Pass current filters to template so controls reflect state
-    return render_template("index.html", games=games, 
-                         current_search=search, 
-                         current_sort=sort, 
-                         current_platform=platform)
+    return render_library("index.html", search, sort, platform,
+                          current_search=search, 
+                          current_sort=sort, 
+                          current_platform=platform)
 
 @app.route("/library/grid")
 def library_grid():
     search = request.args.get("search", "")
-    sort = request.args.get("sort", "playtime_desc")
+    sort = library_sort(request.args.get("sort", "playtime_desc"), search)
     platform = request.args.get("platform", "all")
-    games = fetch_games(search, sort, platform)
+    
+    # Next page for infinite scroll: just the rows, appended in place of the loader row
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            cursor = json.loads(cursor)
+        except ValueError:
+            cursor = None
+        if not valid_cursor(cursor):
+            return "Invalid cursor", 400
+        return render_library("partials/library_rows.html", search, sort, platform, cursor)
     
     # Check if this is an HTMX request
     if request.headers.get('HX-Request'):
-        return render_template("partials/library_grid.html", games=games)
+        return render_library("partials/library_grid.html", search, sort, platform)
     
     # If accessed directly (e.g. via browser refresh on a URL modified by hx-replace-url),
     # return the full index page with the state restored.
-    return render_template("index.html", games=games, 
-                         current_search=search, 
-                         current_sort=sort, 
-                         current_platform=platform)
+    return render_library("index.html", search, sort, platform,
+                          current_search=search, 
+                          current_sort=sort, 
+                          current_platform=platform)
 
 @app.route("/recommendations")
 def recommendations_page():
@@ -150,7 +79,7 @@ def backlog_page():
 
 @app.route("/api/backlog")
 def api_backlog():
-    engine = RecommenderEngine()
+    engine = get_engine()
     # Fetch backlog items
     backlog_games = engine.get_backlog_recommendations(limit=48)
     # Render partial
@@ -160,30 +89,26 @@ def api_backlog():
 def api_recommendations():
     genre = request.args.get('genre', 'all')
     platform = request.args.get('platform', 'all')
-    engine = RecommenderEngine()
-    recs = engine.get_recommendations(limit=9, genre_filter=genre, platform_filter=platform)
+    engine = get_engine()
+    # Prices are filled in per card by /api/prices so the list renders without waiting on CheapShark
+    recs = engine.get_recommendations(limit=9, genre_filter=genre, platform_filter=platform, include_prices=False)
     return render_template("partials/recommendation_list.html", recommendations=recs)
 
+@app.route("/api/prices")
+def api_prices():
+    title = request.args.get('title', '')
+    prices = get_game_price(title) if title else None
+    return render_template("partials/price_info.html", prices=prices)
+
 @app.route("/api/recommendations/dismiss/<int:igdb_id>", methods=["POST"])
 def dismiss_recommendation(igdb_id):
     reason = request.args.get("reason", "not_interested")
     
-    conn = get_db_connection()
     try:
-        # Check if table has 'reason' column (migration handling safety)
-        cursor = conn.execute("PRAGMA table_info(ignored_recommendations)")
-        columns = [row[1] for row in cursor.fetchall()]
-        
-        if 'reason' not in columns:
-            conn.execute("ALTER TABLE ignored_recommendations ADD COLUMN reason TEXT DEFAULT 'not_interested'")
-            
-        conn.execute("INSERT OR REPLACE INTO ignored_recommendations (igdb_id, reason) VALUES (?, ?)", (igdb_id, reason))
-        conn.commit()
+        write(lambda conn: conn.execute("INSERT OR REPLACE INTO ignored_recommendations (igdb_id, reason) VALUES (?, ?)", (igdb_id, reason)))
     except Exception as e:
         print(f"Dismiss error: {e}")
         return f"<div class='alert alert-danger'>Error: {e}</div>", 500
-    finally:
-        conn.close()
         
     return """
     <div class="col-md-6 col-lg-4 mb-4">
@@ -201,7 +126,7 @@ def dismiss_recommendation(igdb_id):
 
 @app.route("/api/profile")
 def api_profile():
-    engine = RecommenderEngine()
+    engine = get_engine()
     profile = engine.build_user_profile()
     
     if not profile:
@@ -267,7 +192,7 @@ def analyze_game():
     else:
         igdb_id = None
         
-    engine = RecommenderEngine()
+    engine = get_engine()
     result = engine.analyze_game(title, igdb_id=igdb_id)
     
     if not result:
@@ -275,6 +200,52 @@ def analyze_game():
         
     return render_template("partials/analysis_result.html", result=result)
 
+# Upper bound on games scored per batch request
+ANALYZE_BATCH_LIMIT = 200
+
+@app.route("/api/analyze/batch", methods=['POST'])
+def analyze_games():
+    """
+    Scores a list of games (e.g. a wishlist or sale page) in one request.
+    Accepts form fields 'titles' (one per line) and 'igdb_ids' (comma separated),
+    or a JSON body {"titles": [...], "igdb_ids": [...]} which gets a JSON response.
+    """
+    data = None
+    if request.is_json:
+        data = request.get_json(silent=True)
+        # Malformed JSON (None) must not fall through to the form branch and get HTML back
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        titles = data.get('titles') or []
+        raw_ids = data.get('igdb_ids') or []
+        if not isinstance(titles, list) or not isinstance(raw_ids, list):
+            return jsonify({"error": "titles and igdb_ids must be lists"}), 400
+    else:
+        titles = (request.form.get('titles') or '').splitlines()
+        raw_ids = (request.form.get('igdb_ids') or '').replace(',', ' ').split()
+
+    queries = []
+    for raw in raw_ids:
+        try:
+            queries.append(int(raw))
+        except (TypeError, ValueError):
+            pass
+    queries.extend(t.strip() for t in titles if isinstance(t, str) and t.strip())
+    queries = list(dict.fromkeys(queries))[:ANALYZE_BATCH_LIMIT]
+
+    engine = get_engine()
+    results = engine.analyze_games(queries) if queries else []
+
+    if data is not None:
+        return jsonify([{'query': q, 'result': r} for q, r in zip(queries, results)])
+
+    if not queries:
+        return "<div class='alert alert-warning'>Enter at least one title or IGDB ID.</div>"
+
+    found = sorted((r for r in results if r), key=lambda r: r['score'], reverse=True)
+    not_found = [q for q, r in zip(queries, results) if not r]
+    return render_template("partials/analysis_batch.html", results=found, not_found=not_found)
+
 # --- Modals ---
 
 @app.route("/modal/edit/<int:game_id>")
@@ -309,36 +280,38 @@ def modal_backlog_dismiss(lib_id):
 
 @app.route("/api/sync", methods=["POST"])
 def sync_library():
-    # Trigger full sync
-    try:
-        if os.getenv("STEAM_API_KEY"):
-            ingest_steam()
-        if os.getenv("PSN_NPSSO"):
-            ingest_psn()
-            
-        # Epic (Legendary)
-        if os.path.exists(os.path.expanduser("~/.config/legendary")):
-            ingest_epic()
-            
-        # Xbox
-        if os.path.exists("xbox_tokens.json"):
-            ingest_xbox()
-            
-        # GOG
-        if os.path.exists("gog_token.txt"):
-            with open("gog_token.txt", "r") as f:
-                token = f.read().strip()
-                if token:
-                    ingest_gog(token)
-            
-        # Also ensure IGDB sync happens if we found new stuff
-        from igdb import sync_library_metadata
-        sync_library_metadata()
-        
-        return "", 204
-    except Exception as e:
-        print(f"Sync error: {e}")
-        return str(e), 500
+    # Start a background sync, or attach to the one already running
+    job = start_sync_job()
+    return render_sync_job(job)
+
+@app.route("/api/sync/current")
+def sync_current():
+    # Lets a freshly loaded page pick up a sync that is still running
+    job = current_sync_job()
+    if not job or job.status != 'running':
+        return ""
+    return render_sync_job(job)
+
+@app.route("/api/sync/<job_id>")
+def sync_status(job_id):
+    job = get_sync_job(job_id)
+    if not job:
+        return "Unknown sync job", 404
+    return render_sync_job(job)
+
+@app.route("/api/sync/<job_id>/cancel", methods=["POST"])
+def sync_cancel(job_id):
+    job = get_sync_job(job_id)
+    if not job:
+        return "Unknown sync job", 404
+    job.cancel()
+    return render_sync_job(job)
+
+def render_sync_job(job):
+    """Progress partial for htmx (polls itself while running), JSON for everything else."""
+    if request.headers.get('HX-Request'):
+        return render_template("partials/sync_progress.html", job=job.to_dict())
+    return jsonify(job.to_dict())
 
 @app.route("/api/game/edit/<int:lib_id>", methods=["POST"])
 def edit_game(lib_id):
@@ -347,50 +320,47 @@ def edit_game(lib_id):
     rating = request.form.get("rating", type=int)
     forced_played = request.form.get("played_toggle") == "on"
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check for linked game_id first for propagation
-    row = cursor.execute("SELECT game_id FROM user_library WHERE id = ?", (lib_id,)).fetchone()
-    gid = row['game_id'] if row else None
-    
     # logic to force played if toggle is on
     if forced_played and status == 'unplayed':
         status = 'played'
 
-    # 1. Update Library Metadata
-    if gid:
-        # Propagate to all entries for this game
-        cursor.execute("""
-            UPDATE user_library 
-            SET playtime_minutes = ?, manual_play_status = ? 
-            WHERE game_id = ?
-        """, (playtime, status, gid))
-    else:
-        # Only update this specific entry
-        cursor.execute("""
-            UPDATE user_library 
-            SET playtime_minutes = ?, manual_play_status = ? 
-            WHERE id = ?
-        """, (playtime, status, lib_id))
-
-    # 2. Update Rating (Linked via game_id)
-    if gid:
-        if rating:
-            cursor.execute("INSERT OR REPLACE INTO ratings (game_id, rating) VALUES (?, ?)", (gid, rating))
+    def save(conn):
+        cursor = conn.cursor()
+        # Check for linked game_id first for propagation
+        row = cursor.execute("SELECT game_id FROM user_library WHERE id = ?", (lib_id,)).fetchone()
+        gid = row['game_id'] if row else None
+
+        # 1. Update Library Metadata
+        if gid:
+            # Propagate to all entries for this game
+            cursor.execute("""
+                UPDATE user_library 
+                SET playtime_minutes = ?, manual_play_status = ? 
+                WHERE game_id = ?
+            """, (playtime, status, gid))
         else:
-            cursor.execute("DELETE FROM ratings WHERE game_id = ?", (gid,))
-            
-    conn.commit()
-    conn.close()
+            # Only update this specific entry
+            cursor.execute("""
+                UPDATE user_library 
+                SET playtime_minutes = ?, manual_play_status = ? 
+                WHERE id = ?
+            """, (playtime, status, lib_id))
+
+        # 2. Update Rating (Linked via game_id)
+        if gid:
+            if rating:
+                cursor.execute("INSERT OR REPLACE INTO ratings (game_id, rating) VALUES (?, ?)", (gid, rating))
+            else:
+                cursor.execute("DELETE FROM ratings WHERE game_id = ?", (gid,))
+
+    write(save)
     
     # Return updated grid with current filters preserved
     search = request.form.get("search", "")
-    sort_by = request.form.get("sort", "playtime_desc")
+    sort_by = library_sort(request.form.get("sort", "playtime_desc"), search)
     platform = request.form.get("platform", "all")
     
-    games = fetch_games(search=search, sort_by=sort_by, platform=platform) 
-    return render_template("partials/library_grid.html", games=games)
+    return render_library("partials/library_grid.html", search, sort_by, platform)
 
 @app.route("/api/backlog/dismiss/<int:lib_id>", methods=["POST"])
 def dismiss_backlog_game(lib_id):
@@ -402,10 +372,8 @@ def dismiss_backlog_game(lib_id):
     else:
         status = 'dropped'
         
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    try:
+    def dismiss(conn):
+        c = conn.cursor()
         # Get game_id logic
         row = c.execute("SELECT game_id FROM user_library WHERE id = ?", (lib_id,)).fetchone()
         gid = row['game_id'] if row else None
@@ -420,13 +388,12 @@ def dismiss_backlog_game(lib_id):
             # Update single instance
             c.execute("UPDATE user_library SET manual_play_status = ? WHERE id = ?", (status, lib_id))
             # Can't rate unmatched games
-            
-        conn.commit()
+
+    try:
+        write(dismiss)
     except Exception as e:
         print(f"Dismiss error: {e}")
         return f"<div class='alert alert-danger'>Error: {e}</div>", 500
-    finally:
-        conn.close()
         
     # Feedback UI
     icon = "bi-check-circle-fill text-success" if status == 'played' else "bi-archive-fill text-secondary"
@@ -448,44 +415,38 @@ def dismiss_backlog_game(lib_id):
 def add_game_manual():
     title = request.form.get("title")
     if title:
-        conn = get_db_connection()
-        conn.execute("INSERT INTO user_library (platform, platform_id, original_title, manual_play_status) VALUES (?, ?, ?, ?)",
-                     ('manual', f"man_{os.urandom(4).hex()}", title, 'unplayed'))
-        conn.commit()
+        write(lambda conn: conn.execute("INSERT INTO user_library (platform, platform_id, original_title, manual_play_status) VALUES (?, ?, ?, ?)",
+                                        ('manual', f"man_{os.urandom(4).hex()}", title, 'unplayed')))
         
         # Trigger minimal enrichment for this new title
         from igdb import sync_library_metadata
         sync_library_metadata()
         
-        conn.close()
-        
-    games = fetch_games()
-    return render_template("partials/library_grid.html", games=games)
+    return render_library("partials/library_grid.html")
 
 @app.route("/api/game/delete/<int:lib_id>", methods=["DELETE"])
 def delete_game(lib_id):
-    conn = get_db_connection()
-    # 1. Get info for blacklist
-    row = conn.execute("SELECT platform, platform_id, original_title FROM user_library WHERE id = ?", (lib_id,)).fetchone()
-    
-    if row:
-        # 2. Add to blacklist if not manual (manual added games don't need blacklist, just delete)
-        if row['platform'] != 'manual':
-            conn.execute("INSERT OR IGNORE INTO blacklist (platform, platform_id, title) VALUES (?, ?, ?)", 
-                         (row['platform'], row['platform_id'], row['original_title']))
-        
-        # 3. Delete foreign keys? (ratings)
-        # Ratings are linked by game_id. If other lib entries use same game_id (unlikely in this model), we keep it. 
-        # But here user_library is the main "game instance".
-        # We should leave the 'games' table alone (golden record).
-        # We might want to remove the rating if it's unique to this user lib entry, but rating is just (game_id, rating).
-        # Let's leave the rating for now or find the game_id and delete rating?
-        # If I delete the game from library, the recommender won't see it, which is correct.
-        
-        conn.execute("DELETE FROM user_library WHERE id = ?", (lib_id,))
-        conn.commit()
+    def delete(conn):
+        # 1. Get info for blacklist
+        row = conn.execute("SELECT platform, platform_id, original_title FROM user_library WHERE id = ?", (lib_id,)).fetchone()
         
-    conn.close()
+        if row:
+            # 2. Add to blacklist if not manual (manual added games don't need blacklist, just delete)
+            if row['platform'] != 'manual':
+                conn.execute("INSERT OR IGNORE INTO blacklist (platform, platform_id, title) VALUES (?, ?, ?)", 
+                             (row['platform'], row['platform_id'], row['original_title']))
+            
+            # 3. Delete foreign keys? (ratings)
+            # Ratings are linked by game_id. If other lib entries use same game_id (unlikely in this model), we keep it. 
+            # But here user_library is the main "game instance".
+            # We should leave the 'games' table alone (golden record).
+            # We might want to remove the rating if it's unique to this user lib entry, but rating is just (game_id, rating).
+            # Let's leave the rating for now or find the game_id and delete rating?
+            # If I delete the game from library, the recommender won't see it, which is correct.
+            
+            conn.execute("DELETE FROM user_library WHERE id = ?", (lib_id,))
+
+    write(delete)
     return "" # Return empty string to remove row, or 200. Used with hx-swap="delete" usually or target closest tr
 
 
@@ -514,7 +475,7 @@ def search_igdb():
     body = f'fields name, cover.url, first_release_date; search "{query}"; limit 5;'
     
     try:
-        resp = requests.post(url, headers=headers, data=body)
+        resp = http_client.post('igdb', url, headers=headers, data=body)
         results = resp.json()
         
         html = ""
@@ -580,7 +541,7 @@ def get_achievements(lib_id):
                 if key and steam_id and appid:
                     url = "http://api.steampowered.com/ISteamUserStats/GetPlayerAchievements/v0001/"
                     try:
-                        resp = requests.get(url, params={'appid': appid, 'key': key, 'steamid': steam_id}, timeout=3)
+                        resp = http_client.get('steam', url, params={'appid': appid, 'key': key, 'steamid': steam_id}, timeout=3)
                         if resp.status_code == 200:
                             data = resp.json().get('playerstats', {})
                             if 'achievements' in data:
@@ -596,13 +557,12 @@ def get_achievements(lib_id):
                              # "Requested app has no stats" -> It means no achievements exist
                              new_total = -1 
                              needs_update = True
-                    except requests.exceptions.Timeout:
+                    except http_client.Timeout:
                         pass
 
             if needs_update:
-                conn.execute("UPDATE user_library SET achievements_unlocked = ?, achievements_total = ? WHERE id = ?", 
-                             (unlocked, new_total, lib_id))
-                conn.commit()
+                write(lambda c: c.execute("UPDATE user_library SET achievements_unlocked = ?, achievements_total = ? WHERE id = ?", 
+                                          (unlocked, new_total, lib_id)))
                 total = new_total
 
         except Exception as e:
@@ -870,21 +830,13 @@ def rematch_modal(lib_id):
 
 @app.route("/api/library/<int:lib_id>/unlink", methods=["POST"])
 def unlink_game(lib_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("UPDATE user_library SET game_id = NULL WHERE id = ?", (lib_id,))
-    conn.commit()
-    conn.close()
+    write(lambda conn: conn.execute("UPDATE user_library SET game_id = NULL WHERE id = ?", (lib_id,)))
     # Return a refresh script or redirect
     return "<script>window.location.reload()</script>"
 
 @app.route("/api/library/<int:lib_id>/ignore", methods=["POST"])
 def ignore_library_item(lib_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("UPDATE user_library SET hidden_from_analysis = 1 WHERE id = ?", (lib_id,))
-    conn.commit()
-    conn.close()
+    write(lambda conn: conn.execute("UPDATE user_library SET hidden_from_analysis = 1 WHERE id = ?", (lib_id,)))
     return "<script>window.location.reload()</script>"
     return "<script>window.location.reload()</script>"
 
@@ -898,19 +850,25 @@ def apply_rematch():
     
     client = IGDBClient()
     conn = get_db_connection()
-    c = conn.cursor()
     
     try:
         # Check if game exists in 'games' table
-        existing = c.execute("SELECT id FROM games WHERE igdb_id = ?", (igdb_id,)).fetchone()
-        final_game_db_id = None
+        existing = conn.execute("SELECT id FROM games WHERE igdb_id = ?", (igdb_id,)).fetchone()
+        meta = None
         
-        if existing:
-            final_game_db_id = existing['id']
-        else:
+        if not existing:
             # Fetch metadata from IGDB
             meta = client.get_game_metadata(igdb_id)
-            if meta and isinstance(meta, dict):
+            if not meta or not isinstance(meta, dict):
+                 return "<div class='alert alert-danger'>IGDB Data Not Found or Invalid</div>"
+
+        def link(conn):
+            c = conn.cursor()
+            # Looked up again here in case another write added the game meanwhile
+            existing = c.execute("SELECT id FROM games WHERE igdb_id = ?", (igdb_id,)).fetchone()
+            if existing:
+                final_game_db_id = existing['id']
+            else:
                 g = meta
                 # Genres/Themes/Keywords are already lists of strings in our wrapper
                 genres = json.dumps(g.get('genres', []))
@@ -937,16 +895,16 @@ def apply_rematch():
                     0
                 ))
                 final_game_db_id = c.lastrowid
-            else:
-                 return "<div class='alert alert-danger'>IGDB Data Not Found or Invalid</div>"
-        
-        # Link it
-        if final_game_db_id:
-             c.execute("UPDATE user_library SET game_id = ? WHERE id = ?", (final_game_db_id, lib_id))
-             conn.commit()
-             return "<script>window.location.reload()</script>"
-        else:
-             return "<div class='alert alert-danger'>Database Error</div>"
+                set_game_tags(conn, final_game_db_id, g)
+            
+            # Link it
+            c.execute("UPDATE user_library SET game_id = ? WHERE id = ?", (final_game_db_id, lib_id))
+            entry = c.execute("SELECT original_title FROM user_library WHERE id = ?", (lib_id,)).fetchone()
+            if entry and entry['original_title']:
+                clear_title_misses(conn, [entry['original_title']])
+
+        write(link)
+        return "<script>window.location.reload()</script>"
             
     except Exception as e:
         return f"<div class='alert alert-danger'>Error: {str(e)}</div>"
@@ -961,12 +919,12 @@ def epic_free_games():
 
     try:
         games = get_free_games()
-        engine = RecommenderEngine()
+        engine = get_engine()
         
         # Analyze match score for each game
         if engine.is_ready():
-            for game in games:
-                raw_score = engine.score_text(game['description'])
+            raw_scores = engine.score_texts([game['description'] for game in games])
+            for game, raw_score in zip(games, raw_scores):
                 # Scale raw score (0.0 to 1.0) to percentage
                 # Cosine similarity is usually low for text (0.1-0.3 is decent). 
                 # Let's normalize loosely: 0.2 => 80%? 
@@ -1002,12 +960,8 @@ def ignore_batch():
     try:
         ids = [int(x) for x in ids_str.split(",") if x.strip().isdigit()]
         if ids:
-            conn = get_db_connection()
-            c = conn.cursor()
             placeholders = ','.join(['?'] * len(ids))
-            c.execute(f"UPDATE user_library SET hidden_from_analysis = 1 WHERE id IN ({placeholders})", ids)
-            conn.commit()
-            conn.close()
+            write(lambda conn: conn.execute(f"UPDATE user_library SET hidden_from_analysis = 1 WHERE id IN ({placeholders})", ids))
     except Exception as e:
         print(f"Error ignoring batch: {e}")
         
@@ -1054,15 +1008,14 @@ def backlog_update():
     if not library_ids:
         return jsonify({"error": "No IDs provided"}), 400
         
-    conn = get_db_connection()
-    try:
+    # 1. Update user_library status
+    status = 'played'
+    if action == 'dropped': status = 'dropped'
+    if action == 'completed': status = 'completed'
+
+    def update(conn):
         cursor = conn.cursor()
         
-        # 1. Update user_library status
-        status = 'played'
-        if action == 'dropped': status = 'dropped'
-        if action == 'completed': status = 'completed'
-        
         # Use executemany or formatted IN clause
         placeholders = ','.join('?' * len(library_ids))
         cursor.execute(f"""
@@ -1085,17 +1038,21 @@ def backlog_update():
                 """, (game_id, int(rating)))
                 print(f"Updated rating for game {game_id} to {rating}")
 
-        conn.commit()
+    try:
+        write(update)
     except Exception as e:
         print(f"Error updating backlog: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
         
     # Return updated backlog list
-    recommender = RecommenderEngine()
+    recommender = get_engine()
     backlog_games = recommender.get_backlog_recommendations(limit=48) # Refresh list
     return render_template('partials/backlog_list.html', games=backlog_games)
 
+@app.route("/api/http-stats")
+def http_stats():
+    """Per-endpoint outbound call, latency and error counters since startup."""
+    return jsonify(http_client.get_stats())
+
 if __name__ == "__main__":
+    init_db()
     app.run(host="0.0.0.0", port=5001, debug=True)
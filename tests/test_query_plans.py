@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+import db
+import recommend
+from library import LIBRARY_SORTS, library_query
+from recommend import BACKLOG_QUERY
+
+# The hot queries must stay index lookups: a plan that starts scanning user_library or games
+# again means an index (see db.MIGRATIONS) or the query's shape regressed.
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    # Everything the app would write under data/ goes to a temp dir, and is pointed back afterwards
+    data_dir = tmp_path_factory.mktemp("data")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(db, 'DATA_DIR', str(data_dir))
+        mp.setattr(db, 'DB_PATH', str(data_dir / "games.db"))
+        mp.setattr(recommend, 'MODEL_DIR', str(data_dir / "models"))
+        db.init_db()
+        conn = sqlite3.connect(db.DB_PATH)
+        try:
+            yield conn
+        finally:
+            conn.close()
+            # Pooled connections still point at the temp database
+            db.close_idle_connections()
+
+def plan(conn, sql, params=()):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def assert_no_scan(steps, *tables):
+    for step in steps:
+        for table in tables:
+            assert step.split()[:2] != ["SCAN", table], steps
+
+@pytest.mark.parametrize("platform", ["all", "steam"])
+@pytest.mark.parametrize("sort_by", [s for s in LIBRARY_SORTS if s != 'relevance'])
+def test_library_page_is_an_index_range(conn, sort_by, platform):
+    column, _ = LIBRARY_SORTS[sort_by]
+    key = 0 if column in ('playtime_minutes', 'rating') else ''
+    for cursor in (None, [key, 1]):
+        steps = plan(conn, *library_query("", sort_by, platform, cursor))
+        assert steps[0].startswith("SEARCH gr USING INDEX idx_library_groups_"), steps
+        assert not any("TEMP B-TREE" in step for step in steps), steps
+        assert "SEARCH ul USING INTEGER PRIMARY KEY (rowid=?)" in steps
+        assert_no_scan(steps, "ul", "g", "user_library", "games")
+
+@pytest.mark.parametrize("sort_by", ["relevance", "title_asc"])
+def test_library_search_runs_match_first(conn, sort_by):
+    steps = plan(conn, *library_query("elden ri", sort_by, "psn"))
+    assert any(step.startswith("SCAN library_search VIRTUAL TABLE") for step in steps), steps
+    assert "SEARCH ul USING INTEGER PRIMARY KEY (rowid=?)" in steps
+    assert_no_scan(steps, "ul", "g", "user_library", "games")
+
+def test_backlog_query_uses_indexes(conn):
+    steps = plan(conn, BACKLOG_QUERY)
+    assert "SEARCH ul USING INDEX idx_user_library_status (manual_play_status=?)" in steps
+    assert "SEARCH ul2 USING INDEX idx_user_library_game_id (game_id=?)" in steps
+    assert_no_scan(steps, "ul", "g", "user_library", "games")
+
+def test_unlinked_entries_lookup_uses_index(conn):
+    # igdb.sync_library_metadata's pending entries
+    steps = plan(conn, "SELECT id, platform, platform_id, original_title FROM user_library WHERE game_id IS NULL")
+    assert steps == ["SEARCH user_library USING INDEX idx_user_library_game_id (game_id=?)"]
+
+def test_ingest_lookups_use_platform_entry_index(conn):
+    ingest = pytest.importorskip("ingest")
+
+    steps = plan(conn, ingest.UPSERT_LIBRARY_SQL, {
+        'platform': 'steam', 'platform_id': '1', 'title': 'x', 'playtime': 0, 'last_played': None,
+        'played_after': 10, 'keep_zero': 0,
+    })
+    assert any(step.startswith("SEARCH b USING COVERING INDEX sqlite_autoindex_blacklist_1") for step in steps), steps
+
+    steps = plan(conn, ingest.MIGRATE_XBOX_SQL, ('1', '1'))
+    assert any("USING INDEX idx_user_library_platform_entry (platform=? AND platform_id=?)" in step for step in steps), steps
+    assert_no_scan(steps, "user_library")
+
+    steps = plan(conn, ingest.COUNT_EXISTING_SQL.format(placeholders='?,?'), ('steam', '1', '2'))
+    assert steps == [
+        "SEARCH user_library USING COVERING INDEX idx_user_library_platform_entry (platform=? AND platform_id=?)"
+    ]